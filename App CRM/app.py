@@ -1,14 +1,506 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context, g
+from flask import before_render_template, template_rendered, make_response, session
+from werkzeug.http import is_resource_modified
 import pandas as pd
 import os
-from datetime import datetime
+import atexit
+import bisect
+import codecs
+import cProfile
+import csv
+import functools
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import pstats
+import re
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    # Sin pyarrow las campañas se leen siempre del .xlsx
+    pa = None
+    feather = None
+
+try:
+    import brotli
+except ImportError:
+    # Sin brotli las respuestas se comprimen solo con gzip
+    brotli = None
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: los candados entre procesos se toman con msvcrt
+    fcntl = None
+    import msvcrt
 
 app = Flask(__name__)
-app.secret_key = 'tu_clave_secreta_aqui'
+# Clave con que se firman la sesión y los mensajes; con varios workers todos
+# deben usar la misma, definida en CRM_SECRET_KEY
+DEV_SECRET_KEY = 'tu_clave_secreta_aqui'
+app.secret_key = os.environ.get('CRM_SECRET_KEY', DEV_SECRET_KEY)
 
 # Directorio para almacenar los archivos de campañas
-CAMPAIGNS_DIR = 'campañas'
+CAMPAIGNS_DIR = os.environ.get('CRM_CAMPAIGNS_DIR', 'campañas')
 CAMPAIGNS_LIST_FILE = 'lista_campañas.txt'
+STATE_DB_FILE = '.estado.db'
+LOCKS_DIR = '.locks'
+JOURNAL_DIR = '.journal'
+WRITE_BEHIND_LOCK_FILE = 'activo.lock'
+AUDIT_DB_FILE = '.historial.db'
+SEARCH_INDEX_DIR = '.indice'
+
+# Columnas que debe tener el archivo de cada campaña
+REQUIRED_COLUMNS = ["Nombre", "Cedula", "Telefono", "Telefono2", "Estatus", "Comentario", "FechaActualizacion"]
+
+# Versión de cada registro: un contador que aumenta con cada edición y se
+# guarda junto a las demás columnas. Quien edita envía la versión que vio
+# (ver update_campaign_record); los archivos sin esta columna empiezan en 0
+VERSION_COLUMN = "Version"
+STORED_COLUMNS = REQUIRED_COLUMNS + [VERSION_COLUMN]
+
+# Esquema en memoria: estas columnas son texto (string de pyarrow si está
+# instalado), Estatus es categórica y FechaActualizacion una fecha (o texto
+# si el archivo tiene fechas que no se pueden interpretar, ver parse_dates)
+TEXT_COLUMNS = ["Nombre", "Cedula", "Telefono", "Telefono2", "Comentario"]
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+DATE_DTYPE = 'datetime64[s]'
+
+# Contadores del panel de estadísticas y el estatus que cuenta cada uno
+STATUS_STATS = {
+    'pendientes': 'Pendiente',
+    'llamados': 'Llamado',
+    'elegibles': 'Elegible',
+    'no_elegibles': 'No Elegible',
+    'NoTieneWhatsapp': 'No Tiene Whatsapp'
+}
+
+ESTATUS_OPTIONS = list(STATUS_STATS.values())
+
+# Columnas en las que busca el filtro de texto de cada campaña
+SEARCH_COLUMNS = ["Nombre", "Cedula", "Telefono", "Telefono2", "Comentario"]
+
+# Búsqueda global: columnas indexadas, máximo de resultados y cada cuánto
+# (en segundos) se guardan en disco los cambios incrementales del índice
+INDEX_COLUMNS = ["Nombre", "Cedula", "Telefono", "Telefono2"]
+GLOBAL_SEARCH_LIMIT = 50
+SEARCH_INDEX_SAVE_INTERVAL = 30
+
+# Columnas con una versión normalizada en memoria (cédula solo con dígitos,
+# teléfonos en formato E.164) para buscar y detectar duplicados sin
+# importar cómo se escribieron; código de país de los números nacionales
+CONTACT_KEY_COLUMNS = ["Cedula", "Telefono", "Telefono2"]
+DEFAULT_COUNTRY_CODE = '1'
+
+# Búsqueda de duplicados: grupos que se incluyen en el informe y trabajos
+# que se recuerdan
+DEDUPE_REPORT_LIMIT = 200
+MAX_DEDUPE_JOBS = 20
+
+# Segundos que un agente tiene reservado el contacto que se le asignó
+LEASE_SECONDS = int(os.environ.get('CRM_LEASE_SECONDS', '600'))
+
+# Paginación de la tabla de registros
+DEFAULT_PAGE_SIZE = 50
+PAGE_SIZE_OPTIONS = [25, 50, 100, 200]
+
+# Motor de almacenamiento: 'excel' (un .xlsx por campaña) o 'sqlite'
+STORAGE_BACKEND = os.environ.get('CRM_STORAGE_BACKEND', 'excel')
+SQLITE_DB_FILE = 'campañas.db'
+
+# Copia en formato Arrow (Feather) junto a cada .xlsx para cargar rápido las
+# campañas; solo se usa con el motor 'excel' y si pyarrow está instalado
+ARROW_SIDECAR = feather is not None and os.environ.get('CRM_ARROW_SIDECAR', '1') == '1'
+TEXT_DTYPE = pd.StringDtype('pyarrow' if pa is not None else 'python')
+# Texto que se modifica fila por fila (el comentario y el texto de búsqueda):
+# en un arreglo de Arrow cada asignación copia la columna entera, con objetos
+# de Python es inmediata
+EDITABLE_TEXT_DTYPE = pd.StringDtype('python')
+EDITABLE_TEXT_COLUMNS = ["Comentario"]
+
+# Escritura diferida: los cambios de registros se confirman al anotarlos en
+# un diario y se guardan en lote cada FLUSH_INTERVAL segundos o al juntar
+# FLUSH_MAX_PENDING cambios de una campaña
+WRITE_BEHIND = os.environ.get('CRM_WRITE_BEHIND', '0') == '1'
+FLUSH_INTERVAL = float(os.environ.get('CRM_FLUSH_INTERVAL', '2'))
+FLUSH_MAX_PENDING = int(os.environ.get('CRM_FLUSH_MAX_PENDING', '500'))
+
+# Importación masiva: encabezados aceptados (en minúsculas, sin acentos ni
+# espacios) para cada columna de la campaña
+IMPORT_EXTENSIONS = ('.csv', '.xlsx')
+IMPORT_COLUMN_ALIASES = {
+    'nombre': 'Nombre', 'nombres': 'Nombre', 'nombrecompleto': 'Nombre', 'name': 'Nombre',
+    'cedula': 'Cedula', 'nocedula': 'Cedula', 'documento': 'Cedula', 'identificacion': 'Cedula',
+    'telefono': 'Telefono', 'telefono1': 'Telefono', 'celular': 'Telefono', 'movil': 'Telefono',
+    'telefonoprincipal': 'Telefono', 'phone': 'Telefono',
+    'telefono2': 'Telefono2', 'telefonosecundario': 'Telefono2', 'otrotelefono': 'Telefono2',
+    'celular2': 'Telefono2',
+    'estatus': 'Estatus', 'estado': 'Estatus',
+    'comentario': 'Comentario', 'comentarios': 'Comentario', 'observaciones': 'Comentario',
+}
+MAX_IMPORT_JOBS = 100
+
+# Exportación: filas que se convierten a la vez y tamaño de cada trozo enviado
+EXPORT_FORMATS = ('csv', 'xlsx')
+EXPORT_CHUNK_ROWS = 5000
+EXPORT_CHUNK_BYTES = 256 * 1024
+
+# Límite de memoria para la caché de campañas (en MB)
+CACHE_MAX_MB = int(os.environ.get('CRM_CACHE_MAX_MB', '512'))
+
+# Compresión de las páginas y respuestas JSON (brotli si está instalado y el
+# navegador lo acepta, si no gzip) a partir de este tamaño en bytes
+COMPRESS_MIMETYPES = {'text/html', 'text/plain', 'application/json'}
+COMPRESS_MIN_BYTES = 500
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+# Métricas en /metrics: límites (en segundos) de los histogramas de duración
+METRICS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+METRICS_HELP = {
+    'xoocrm_request_seconds': ('histogram', 'Duración de las peticiones por ruta'),
+    'xoocrm_requests_total': ('counter', 'Peticiones atendidas por ruta y código de respuesta'),
+    'xoocrm_operation_seconds': ('histogram', 'Duración de carga, guardado, filtro, orden y estadísticas'),
+    'xoocrm_template_render_seconds': ('histogram', 'Duración del renderizado de cada plantilla'),
+    'xoocrm_cache_hits_total': ('counter', 'Aciertos de la caché de campañas'),
+    'xoocrm_cache_misses_total': ('counter', 'Fallos de la caché de campañas'),
+    'xoocrm_cache_evictions_total': ('counter', 'Campañas desalojadas de la caché'),
+    'xoocrm_cache_hit_ratio': ('gauge', 'Proporción de aciertos de la caché de campañas'),
+    'xoocrm_cache_bytes': ('gauge', 'Memoria ocupada por la caché de campañas'),
+    'xoocrm_cache_entries': ('gauge', 'Campañas cargadas en la caché'),
+    'xoocrm_campaign_rows': ('gauge', 'Registros de cada campaña según el último conteo guardado'),
+    'xoocrm_write_behind_pending': ('gauge', 'Cambios de escritura diferida aún sin guardar'),
+}
+
+# Perfilado por petición con ?_profile=1 (solo si CRM_PROFILING=1): en lugar
+# de la respuesta se devuelve el informe de cProfile con estas funciones
+PROFILING = os.environ.get('CRM_PROFILING', '0') == '1'
+PROFILE_LINES = 40
+
+class Metrics:
+    """Histogramas y contadores de este proceso en el formato de texto de
+    Prometheus. Con varios workers cada proceso expone los suyos."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.histograms = defaultdict(dict)
+        self.counters = defaultdict(Counter)
+        self.lock = threading.Lock()
+
+    def observe(self, name, seconds, **labels):
+        """Anotar una duración en un histograma"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms[name].get(key)
+            if series is None:
+                series = self.histograms[name][key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            position = bisect.bisect_left(self.buckets, seconds)
+            if position < len(self.buckets):
+                series['buckets'][position] += 1
+            series['sum'] += seconds
+            series['count'] += 1
+
+    def inc(self, name, **labels):
+        """Sumar uno a un contador"""
+        with self.lock:
+            self.counters[name][tuple(sorted(labels.items()))] += 1
+
+    def render(self, values):
+        """Texto para /metrics; values agrega contadores y medidores
+        calculados en el momento ({nombre: [(etiquetas, valor)]})"""
+        lines = []
+        with self.lock:
+            samples = {name: [(dict(key), value) for key, value in series.items()]
+                       for name, series in self.counters.items()}
+            for name, series in values.items():
+                samples[name] = series
+            histograms = {name: {key: dict(value, buckets=list(value['buckets'])) for key, value in series.items()}
+                          for name, series in self.histograms.items()}
+        for name, (kind, help_text) in METRICS_HELP.items():
+            if not samples.get(name) and name not in histograms:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples.get(name, []):
+                lines.append(f'{name}{format_labels(labels)} {value}')
+            for key, series in histograms.get(name, {}).items():
+                labels = dict(key)
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets']):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{format_labels(dict(labels, le=str(bound)))} {cumulative}')
+                lines.append(f'{name}_bucket{format_labels(dict(labels, le="+Inf"))} {series["count"]}')
+                lines.append(f'{name}_sum{format_labels(labels)} {series["sum"]}')
+                lines.append(f'{name}_count{format_labels(labels)} {series["count"]}')
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    """Etiquetas de una serie como {a="1",b="2"}"""
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for value in labels.values())
+    return '{' + ','.join(f'{key}="{value}"' for key, value in zip(labels, escaped)) + '}'
+
+metrics = Metrics(METRICS_BUCKETS)
+
+def timed(operation):
+    """Medir cada llamada a la función en xoocrm_operation_seconds"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                metrics.observe('xoocrm_operation_seconds', time.perf_counter() - start, operation=operation)
+        return wrapper
+    return decorator
+
+class CampaignCache:
+    """Caché LRU en memoria con los datos ya normalizados de cada campaña.
+
+    Cada entrada guarda la firma (mtime, tamaño) del archivo con la que se
+    cargó; si el archivo cambia en disco la entrada deja de ser válida. Cuando
+    la memoria total supera el límite se desalojan las menos usadas.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, campaign_name, signature):
+        """Devolver los datos en caché si la firma coincide, o None"""
+        with self.lock:
+            entry = self.entries.get(campaign_name)
+            if entry is None or entry['signature'] != signature:
+                self.misses += 1
+                if entry is not None:
+                    self._remove(campaign_name)
+                return None
+            self.entries.move_to_end(campaign_name)
+            self.hits += 1
+            return entry['data']
+
+    def put(self, campaign_name, signature, data):
+        """Guardar los datos en caché y desalojar entradas si hace falta"""
+        size = data.memory_usage()
+        with self.lock:
+            if campaign_name in self.entries:
+                self._remove(campaign_name)
+            if size > self.max_bytes:
+                return
+            self.entries[campaign_name] = {'signature': signature, 'data': data, 'size': size}
+            self.total_bytes += size
+            self._evict()
+
+    def peek(self, campaign_name, signature):
+        """Como get, pero sin contar aciertos/fallos ni cambiar el orden LRU"""
+        with self.lock:
+            entry = self.entries.get(campaign_name)
+            if entry is None or entry['signature'] != signature:
+                return None
+            return entry['data']
+
+    def touch(self, campaign_name, signature):
+        """Actualizar la firma de una entrada tras guardar sus cambios, y su
+        tamaño (ver resize)"""
+        with self.lock:
+            entry = self.entries.get(campaign_name)
+            if entry is not None:
+                entry['signature'] = signature
+                self._resize(campaign_name, entry)
+
+    def resize(self, campaign_name):
+        """Volver a tomar el tamaño de una entrada después de modificar sus
+        datos en memoria (ediciones, altas, importaciones) y desalojar
+        entradas si ahora se pasa del límite"""
+        with self.lock:
+            entry = self.entries.get(campaign_name)
+            if entry is not None:
+                self._resize(campaign_name, entry)
+
+    def invalidate(self, campaign_name):
+        """Eliminar una campaña de la caché"""
+        with self.lock:
+            if campaign_name in self.entries:
+                self._remove(campaign_name)
+
+    def stats(self):
+        """Contadores de uso de la caché"""
+        with self.lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes,
+                'max_bytes': self.max_bytes
+            }
+
+    def _resize(self, campaign_name, entry):
+        size = entry['data'].memory_usage()
+        self.total_bytes += size - entry['size']
+        entry['size'] = size
+        if size > self.max_bytes:
+            self._remove(campaign_name)
+            self.evictions += 1
+        self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes:
+            oldest = next(iter(self.entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, campaign_name):
+        entry = self.entries.pop(campaign_name)
+        self.total_bytes -= entry['size']
+
+campaign_cache = CampaignCache(CACHE_MAX_MB * 1024 * 1024)
+
+class FileLock:
+    """Candado entre procesos sobre un archivo .lock.
+
+    Usa flock en Linux/macOS, con modo compartido para lectores y exclusivo
+    para escritores. En Windows usa msvcrt, que solo tiene candados
+    exclusivos, así que ahí los lectores también se excluyen entre sí.
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.file = None
+
+    def acquire(self, blocking=True):
+        """Tomar el candado; sin blocking devuelve False si otro lo tiene"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'a+b')
+        try:
+            if fcntl is not None:
+                mode = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+                fcntl.flock(self.file.fileno(), mode if blocking else mode | fcntl.LOCK_NB)
+                return True
+            while True:
+                try:
+                    self.file.seek(0)
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_NBLCK, 1)
+                    return True
+                except OSError:
+                    if not blocking:
+                        raise
+                    time.sleep(0.05)
+        except OSError:
+            if blocking:
+                raise
+            self.file.close()
+            self.file = None
+            return False
+
+    def release(self):
+        try:
+            if fcntl is not None:
+                fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            else:
+                self.file.seek(0)
+                msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        finally:
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+# Un candado por campaña para serializar las modificaciones entre hilos
+campaign_locks = defaultdict(threading.RLock)
+campaign_locks_guard = threading.Lock()
+
+# Campañas cuyo candado exclusivo de archivo tiene tomado el hilo actual
+held_file_locks = threading.local()
+
+def get_campaign_lock(campaign_name):
+    """Obtener el candado de modificación de una campaña"""
+    with campaign_locks_guard:
+        return campaign_locks[campaign_name]
+
+def get_lock_file_path(name):
+    """Ruta del archivo .lock asociado a un archivo de la carpeta de campañas"""
+    return os.path.join(CAMPAIGNS_DIR, LOCKS_DIR, f'{os.path.basename(name)}.lock')
+
+def held_campaigns():
+    if not hasattr(held_file_locks, 'campaigns'):
+        held_file_locks.campaigns = set()
+    return held_file_locks.campaigns
+
+@contextmanager
+def campaign_write_lock(campaign_name):
+    """Candado exclusivo para modificar una campaña, entre hilos y entre
+    procesos (por ejemplo, varios workers de gunicorn). Es reentrante dentro
+    del mismo hilo."""
+    with get_campaign_lock(campaign_name):
+        held = held_campaigns()
+        if campaign_name in held:
+            yield
+            return
+        with FileLock(get_lock_file_path(get_campaign_file_path(campaign_name))):
+            held.add(campaign_name)
+            try:
+                yield
+            finally:
+                held.discard(campaign_name)
+
+@contextmanager
+def campaign_read_lock(campaign_name):
+    """Candado compartido para leer una campaña desde el almacenamiento"""
+    if campaign_name in held_campaigns():
+        yield
+        return
+    with FileLock(get_lock_file_path(get_campaign_file_path(campaign_name)), shared=True):
+        yield
+
+def campaigns_list_lock():
+    """Candado exclusivo para leer-modificar-guardar la lista de campañas"""
+    return FileLock(get_lock_file_path(CAMPAIGNS_LIST_FILE))
+
+@contextmanager
+def atomic_write(file_path):
+    """Escribir un archivo a través de un temporal en la misma carpeta que
+    luego lo reemplaza de una vez, para no dejar nunca un archivo a medias"""
+    directory, name = os.path.split(file_path)
+    base, ext = os.path.splitext(name)
+    fd, tmp_path = tempfile.mkstemp(prefix=f'.{base}.', suffix=f'.tmp{ext}', dir=directory or '.')
+    os.close(fd)
+    try:
+        yield tmp_path
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
 
 def ensure_campaigns_dir():
     """Asegurar que el directorio de campañas existe"""
@@ -21,10 +513,310 @@ def get_campaign_file_path(campaign_name):
     safe_name = safe_name.replace(' ', '_')
     return os.path.join(CAMPAIGNS_DIR, f'{safe_name}.xlsx')
 
-def load_campaigns_list():
-    """Cargar la lista de campañas existentes"""
+def get_sidecar_path(campaign_name):
+    """Ruta de la copia Arrow (ver ExcelStorage.read_sidecar) de una campaña"""
+    return os.path.splitext(get_campaign_file_path(campaign_name))[0] + '.feather'
+
+def delete_campaign_files(campaign_name):
+    """Borrar el .xlsx de una campaña y su copia Arrow, si existen"""
+    for file_path in (get_campaign_file_path(campaign_name), get_sidecar_path(campaign_name)):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+def get_file_signature(file_path):
+    """Firma (mtime, tamaño) de un archivo, o None si no existe"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+# Cada cambio de un registro se describe con un diccionario:
+#   {'op': 'update', 'cedula': ..., 'values': {columna: valor}}
+#   {'op': 'insert', 'row': {columna: valor}}
+#   {'op': 'delete', 'cedula': ...}
+
+class ExcelStorage:
+    """Almacenamiento original: un archivo .xlsx por campaña.
+
+    Cualquier cambio reescribe el archivo completo con el DataFrame ya
+    actualizado en memoria.
+    """
+
+    name = 'excel'
+
+    def signature(self, campaign_name):
+        """Firma de la versión actual de la campaña, o None si no existe"""
+        return get_file_signature(get_campaign_file_path(campaign_name))
+
+    def read(self, campaign_name):
+        file_path = get_campaign_file_path(campaign_name)
+        if not ARROW_SIDECAR:
+            return pd.read_excel(file_path)
+        signature = get_file_signature(file_path)
+        df = self.read_sidecar(campaign_name, signature)
+        if df is None:
+            df = pd.read_excel(file_path)
+            self.write_sidecar(df, campaign_name, signature)
+        return df
+
+    def write(self, df, campaign_name):
+        """Reemplazar todos los registros y devolver la nueva firma"""
+        file_path = get_campaign_file_path(campaign_name)
+        with atomic_write(file_path) as tmp_path:
+            to_text_frame(df).to_excel(tmp_path, index=False)
+        signature = get_file_signature(file_path)
+        if ARROW_SIDECAR:
+            self.write_sidecar(df, campaign_name, signature)
+        return signature
+
+    def sidecar_path(self, campaign_name):
+        return get_sidecar_path(campaign_name)
+
+    def read_sidecar(self, campaign_name, signature):
+        """Leer la copia Arrow si se generó a partir de esta versión del .xlsx.
+
+        El archivo se abre con memory map: los procesos que leen la misma
+        campaña comparten las páginas en lugar de cargar cada uno su copia.
+        """
+        sidecar_path = self.sidecar_path(campaign_name)
+        if signature is None or not os.path.exists(sidecar_path):
+            return None
+        try:
+            table = feather.read_table(sidecar_path, memory_map=True)
+        except (OSError, pa.ArrowException) as e:
+            print(f"Error leyendo copia Arrow de {campaign_name}: {e}")
+            return None
+        metadata = table.schema.metadata or {}
+        if metadata.get(b'xoocrm_source') != json.dumps(list(signature)).encode():
+            return None
+        df = table.to_pandas()
+        # Las columnas que quedan como arreglos de NumPy (Estatus y la fecha)
+        # apuntan al memory map y son de solo lectura; se copian para poder
+        # modificarlas. El texto sigue en Arrow, compartido.
+        for col in df.columns.difference(TEXT_COLUMNS):
+            df[col] = df[col].copy()
+        return df
+
+    def write_sidecar(self, df, campaign_name, signature):
+        """Guardar la copia Arrow con los tipos del esquema (ver apply_schema);
+        sin compresión para poder leerla con memory map"""
+        try:
+            df = normalize_data(df.copy())
+            if not pd.api.types.is_datetime64_any_dtype(df['FechaActualizacion']):
+                # Hay fechas que quedaron como texto: se guardan todas como texto
+                df = to_text_frame(df)
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            table = table.replace_schema_metadata({
+                **(table.schema.metadata or {}),
+                b'xoocrm_source': json.dumps(list(signature)).encode()
+            })
+            with atomic_write(self.sidecar_path(campaign_name)) as tmp_path:
+                feather.write_feather(table, tmp_path, compression='uncompressed')
+        except Exception as e:
+            print(f"Error guardando copia Arrow de {campaign_name}: {e}")
+
+    def write_changes(self, df, campaign_name, changes):
+        """Persistir una lista de cambios; df ya los tiene aplicados"""
+        return self.write(df, campaign_name)
+
+    def location(self, campaign_name):
+        return get_campaign_file_path(campaign_name)
+
+    def last_modified(self, campaign_name):
+        """Momento (timestamp) de la última escritura, o None si no existe"""
+        file_path = get_campaign_file_path(campaign_name)
+        return os.path.getmtime(file_path) if os.path.exists(file_path) else None
+
+    def delete_campaign(self, campaign_name):
+        delete_campaign_files(campaign_name)
+
+class SQLiteStorage:
+    """Almacenamiento en SQLite (modo WAL) con una tabla de registros indexada
+    por (campaign, Cedula).
+
+    Cada cambio es un UPDATE/INSERT/DELETE de una sola fila en lugar de
+    reescribir el libro completo. La tabla campaigns guarda un número de
+    versión que se incrementa en cada escritura y sirve como firma para la
+    caché, y el momento de esa escritura (la fecha del archivo .db no cambia
+    con cada transacción en modo WAL). Las campañas que todavía solo existen
+    como .xlsx se importan la primera vez que se usan; al eliminar la campaña
+    se borra también ese .xlsx.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+
+    def connection(self):
+        """Conexión SQLite propia de cada hilo"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            ensure_campaigns_dir()
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            with conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS campaigns ('
+                    'name TEXT PRIMARY KEY, version INTEGER NOT NULL, updated_at REAL)'
+                )
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(campaigns)')]
+                if 'updated_at' not in columns:
+                    try:
+                        conn.execute('ALTER TABLE campaigns ADD COLUMN updated_at REAL')
+                    except sqlite3.OperationalError:
+                        # Otro proceso la agregó al mismo tiempo
+                        pass
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS records ('
+                    'id INTEGER PRIMARY KEY, campaign TEXT NOT NULL, '
+                    + ', '.join(f'"{col}" TEXT' for col in REQUIRED_COLUMNS)
+                    + f', "{VERSION_COLUMN}" INTEGER NOT NULL DEFAULT 0)'
+                )
+                columns = [row[1] for row in conn.execute('PRAGMA table_info(records)')]
+                if VERSION_COLUMN not in columns:
+                    try:
+                        conn.execute(f'ALTER TABLE records ADD COLUMN "{VERSION_COLUMN}" INTEGER NOT NULL DEFAULT 0')
+                    except sqlite3.OperationalError:
+                        # Otro proceso la agregó al mismo tiempo
+                        pass
+                conn.execute(
+                    'CREATE INDEX IF NOT EXISTS idx_records_campaign_cedula '
+                    'ON records (campaign, Cedula)'
+                )
+            self.local.conn = conn
+        return conn
+
+    def signature(self, campaign_name):
+        """Versión actual de la campaña, o None si no existe"""
+        row = self.connection().execute(
+            'SELECT version FROM campaigns WHERE name = ?', (campaign_name,)
+        ).fetchone()
+        if row is None and self._migrate_workbook(campaign_name):
+            return self.signature(campaign_name)
+        return (row[0],) if row else None
+
+    def read(self, campaign_name):
+        columns = ', '.join(f'"{col}"' for col in STORED_COLUMNS)
+        return pd.read_sql_query(
+            f'SELECT {columns} FROM records WHERE campaign = ? ORDER BY id',
+            self.connection(), params=(campaign_name,)
+        )
+
+    def write(self, df, campaign_name):
+        """Reemplazar todos los registros y devolver la nueva firma"""
+        conn = self.connection()
+        with conn:
+            conn.execute('DELETE FROM records WHERE campaign = ?', (campaign_name,))
+            self._insert_rows(conn, campaign_name, records_to_dicts(df))
+            return self._bump_version(conn, campaign_name)
+
+    def write_changes(self, df, campaign_name, changes):
+        """Persistir una lista de cambios con escrituras de una sola fila"""
+        conn = self.connection()
+        with conn:
+            pending_inserts = []
+            for change in changes:
+                # Las altas seguidas (por ejemplo, de una importación) van en un solo executemany
+                if change['op'] == 'insert':
+                    pending_inserts.append(change['row'])
+                    continue
+                if pending_inserts:
+                    self._insert_rows(conn, campaign_name, pending_inserts)
+                    pending_inserts = []
+                if change['op'] == 'update':
+                    columns = list(change['values'])
+                    assignments = ', '.join(f'"{col}" = ?' for col in columns)
+                    conn.execute(
+                        f'UPDATE records SET {assignments} WHERE campaign = ? AND Cedula = ?',
+                        [self._to_sql(change['values'][col]) for col in columns]
+                        + [campaign_name, change['cedula']]
+                    )
+                elif change['op'] == 'delete':
+                    conn.execute(
+                        'DELETE FROM records WHERE campaign = ? AND Cedula = ?',
+                        (campaign_name, change['cedula'])
+                    )
+            if pending_inserts:
+                self._insert_rows(conn, campaign_name, pending_inserts)
+            return self._bump_version(conn, campaign_name)
+
+    def location(self, campaign_name):
+        return self.db_path
+
+    def last_modified(self, campaign_name):
+        """Momento (timestamp) de la última escritura, o None si no se sabe"""
+        row = self.connection().execute(
+            'SELECT updated_at FROM campaigns WHERE name = ?', (campaign_name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def delete_campaign(self, campaign_name):
+        # Primero el .xlsx del que se importó, para que signature() no lo
+        # vuelva a importar
+        delete_campaign_files(campaign_name)
+        conn = self.connection()
+        with conn:
+            conn.execute('DELETE FROM records WHERE campaign = ?', (campaign_name,))
+            conn.execute('DELETE FROM campaigns WHERE name = ?', (campaign_name,))
+
+    def _migrate_workbook(self, campaign_name):
+        """Importar el .xlsx existente de una campaña que no está en la base"""
+        file_path = get_campaign_file_path(campaign_name)
+        if not os.path.exists(file_path):
+            return False
+        self.write(normalize_data(pd.read_excel(file_path)), campaign_name)
+        return True
+
+    def _insert_rows(self, conn, campaign_name, rows):
+        columns = ', '.join(f'"{col}"' for col in STORED_COLUMNS)
+        placeholders = ', '.join('?' for _ in range(len(STORED_COLUMNS) + 1))
+        conn.executemany(
+            f'INSERT INTO records (campaign, {columns}) VALUES ({placeholders})',
+            ([campaign_name] + [self._to_sql(row.get(col, '')) for col in REQUIRED_COLUMNS]
+             + [int(row.get(VERSION_COLUMN) or 0)] for row in rows)
+        )
+
+    def _bump_version(self, conn, campaign_name):
+        conn.execute(
+            'INSERT INTO campaigns (name, version, updated_at) VALUES (?, 1, ?) '
+            'ON CONFLICT(name) DO UPDATE SET version = version + 1, updated_at = excluded.updated_at',
+            (campaign_name, time.time())
+        )
+        row = conn.execute(
+            'SELECT version FROM campaigns WHERE name = ?', (campaign_name,)
+        ).fetchone()
+        return (row[0],)
+
+    @staticmethod
+    def _to_sql(value):
+        if is_missing(value):
+            return None
+        return str(value)
+
+def create_storage(backend):
+    """Crear el motor de almacenamiento configurado"""
+    if backend == 'sqlite':
+        return SQLiteStorage(os.path.join(CAMPAIGNS_DIR, SQLITE_DB_FILE))
+    if backend == 'excel':
+        return ExcelStorage()
+    raise ValueError(f'Motor de almacenamiento desconocido: {backend}')
+
+storage = create_storage(STORAGE_BACKEND)
+
+def get_campaigns_list_path():
+    """Ruta del archivo con la lista de campañas"""
+    return os.path.join(CAMPAIGNS_DIR, CAMPAIGNS_LIST_FILE)
+
+def read_campaigns_list():
+    """Leer la lista de campañas del archivo. Si no hay ninguna se devuelve
+    la campaña por defecto sin escribirla: el archivo solo se modifica con
+    campaigns_list_lock() (ver CampaignRegistry.add)"""
     ensure_campaigns_dir()
-    campaigns_file = os.path.join(CAMPAIGNS_DIR, CAMPAIGNS_LIST_FILE)
+    campaigns_file = get_campaigns_list_path()
     
     if os.path.exists(campaigns_file):
         with open(campaigns_file, 'r', encoding='utf-8') as f:
@@ -32,112 +824,2137 @@ def load_campaigns_list():
     else:
         campaigns = []
     
-    # Si no hay campañas, crear una por defecto
+    # Si no hay campañas, usar una por defecto
     if not campaigns:
         campaigns = ['Campaña Principal']
-        save_campaigns_list(campaigns)
     
     return campaigns
 
 def save_campaigns_list(campaigns):
     """Guardar la lista de campañas"""
     ensure_campaigns_dir()
-    campaigns_file = os.path.join(CAMPAIGNS_DIR, CAMPAIGNS_LIST_FILE)
     
-    with open(campaigns_file, 'w', encoding='utf-8') as f:
-        for campaign in campaigns:
-            f.write(f'{campaign}\n')
+    with atomic_write(get_campaigns_list_path()) as tmp_path:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for campaign in campaigns:
+                f.write(f'{campaign}\n')
 
+class CampaignRegistry:
+    """Lista de campañas en memoria (lista ordenada más conjunto para
+    comprobar nombres) que solo vuelve a leer lista_campañas.txt cuando el
+    archivo cambia en disco, por ejemplo porque otro proceso lo modificó.
+
+    Al recargar compara la lista con los .xlsx de la carpeta de campañas y
+    anota los archivos que no pertenecen a ninguna campaña.
+
+    Que el archivo no exista (instalación nueva, con la campaña por defecto)
+    también se recuerda: la firma queda en None y no se vuelve a leer hasta
+    que se cree.
+    """
+
+    def __init__(self):
+        self.campaigns = []
+        self.campaign_set = frozenset()
+        self.signature = None
+        self.loaded = False
+        self.orphans = []
+        self.lock = threading.RLock()
+
+    def refresh(self):
+        """Recargar la lista si el archivo cambió desde la última lectura"""
+        signature = get_file_signature(get_campaigns_list_path())
+        if self.loaded and signature == self.signature:
+            return
+        with self.lock:
+            if self.loaded and signature == self.signature:
+                return
+            self._set(read_campaigns_list())
+            orphans = self.reconcile()
+        if orphans:
+            print(f"Advertencia: {len(orphans)} archivos .xlsx sin campaña en {CAMPAIGNS_DIR}: "
+                  f"{', '.join(orphan['file'] for orphan in orphans)}")
+
+    def _set(self, campaigns):
+        self.campaigns = list(campaigns)
+        self.campaign_set = frozenset(campaigns)
+        self.signature = get_file_signature(get_campaigns_list_path())
+        self.loaded = True
+
+    def names(self):
+        """Nombres de las campañas en el orden de la lista"""
+        self.refresh()
+        return list(self.campaigns)
+
+    def __contains__(self, campaign_name):
+        self.refresh()
+        return campaign_name in self.campaign_set
+
+    def __len__(self):
+        self.refresh()
+        return len(self.campaigns)
+
+    def add(self, campaign_name):
+        """Agregar una campaña a la lista. Llamar con campaigns_list_lock()"""
+        with self.lock:
+            self.refresh()
+            if campaign_name in self.campaign_set:
+                return False
+            campaigns = self.campaigns + [campaign_name]
+            save_campaigns_list(campaigns)
+            self._set(campaigns)
+            self.reconcile()
+            return True
+
+    def remove(self, campaign_name):
+        """Quitar una campaña de la lista. Llamar con campaigns_list_lock()"""
+        with self.lock:
+            self.refresh()
+            if campaign_name not in self.campaign_set:
+                return False
+            campaigns = [name for name in self.campaigns if name != campaign_name]
+            save_campaigns_list(campaigns)
+            self._set(campaigns)
+            self.reconcile()
+            return True
+
+    def reconcile(self):
+        """Buscar en la carpeta de campañas los .xlsx que no son de ninguna
+        campaña de la lista; si el nombre corresponde a una campaña existente
+        (p. ej. con espacios en vez de guiones bajos) se indica cuál"""
+        owners = {os.path.basename(get_campaign_file_path(name)): name for name in self.campaigns}
+        orphans = []
+        for file_name in sorted(os.listdir(CAMPAIGNS_DIR)):
+            # Ignorar temporales de atomic_write y archivos de bloqueo de Excel
+            if file_name.startswith(('.', '~$')) or not file_name.lower().endswith('.xlsx'):
+                continue
+            if file_name in owners:
+                continue
+            stem = os.path.splitext(file_name)[0]
+            orphans.append({
+                'file': file_name,
+                'duplicate_of': owners.get(os.path.basename(get_campaign_file_path(stem)))
+            })
+        with self.lock:
+            self.orphans = orphans
+        return orphans
+
+    def metadata(self, campaign_name):
+        """Ruta, última modificación, cantidad de registros y estatus de una campaña"""
+        modified = storage.last_modified(campaign_name)
+        stats = get_campaign_stats(campaign_name)
+        return {
+            'name': campaign_name,
+            'file_path': storage.location(campaign_name),
+            'last_modified': (datetime.fromtimestamp(modified).strftime("%Y-%m-%d %H:%M:%S")
+                              if modified is not None else None),
+            'rows': stats['total'],
+            'stats': stats
+        }
+
+campaign_registry = CampaignRegistry()
+
+def load_campaigns_list():
+    """Lista de campañas existentes"""
+    return campaign_registry.names()
+
+def normalize_data(df):
+    """Asegurar las columnas necesarias, aplicarles el esquema y convertir
+    valores NaN del resto de columnas a string vacío"""
+    for col in STORED_COLUMNS:
+        if col not in df.columns:
+            if col == "FechaActualizacion":
+                df[col] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            elif col == VERSION_COLUMN:
+                df[col] = 0
+            else:
+                df[col] = ""
+    df = apply_schema(df)
+    other_columns = [col for col in df.columns if col not in STORED_COLUMNS]
+    if other_columns:
+        df[other_columns] = df[other_columns].fillna("")
+    return df
+
+def apply_schema(df):
+    """Convertir las columnas de la campaña a los tipos del esquema.
+
+    Las cédulas y teléfonos que Excel leyó como números pasan a texto sin el
+    '.0', Estatus queda como categoría (los estatus de ESTATUS_OPTIONS más
+    cualquier otro valor que tenga el archivo), las fechas se interpretan
+    con parse_dates y la versión es un entero (0 si está vacía).
+    """
+    for col in TEXT_COLUMNS:
+        dtype = EDITABLE_TEXT_DTYPE if col in EDITABLE_TEXT_COLUMNS else TEXT_DTYPE
+        if isinstance(df[col].dtype, pd.StringDtype):
+            df[col] = df[col].fillna('').astype(dtype)
+        else:
+            df[col] = df[col].map(excel_text).astype(dtype)
+    
+    estatus = df['Estatus']
+    if isinstance(estatus.dtype, pd.CategoricalDtype):
+        values = set(estatus.cat.categories)
+    else:
+        estatus = estatus.map(excel_text)
+        values = set(estatus.unique())
+    extra = sorted(values - set(ESTATUS_OPTIONS))
+    df['Estatus'] = estatus.astype(pd.CategoricalDtype(ESTATUS_OPTIONS + extra))
+    
+    fecha = df['FechaActualizacion']
+    if pd.api.types.is_datetime64_any_dtype(fecha):
+        df['FechaActualizacion'] = fecha.astype(DATE_DTYPE)
+    else:
+        df['FechaActualizacion'] = parse_dates(fecha.map(excel_text))
+    
+    df[VERSION_COLUMN] = pd.to_numeric(df[VERSION_COLUMN], errors='coerce').fillna(0).astype('int64')
+    return df
+
+def parse_dates(text):
+    """Interpretar una columna de fechas en texto: primero como ISO 8601 y
+    las que no lo son con el día primero (15/06/2025) u otros formatos.
+
+    Si alguna fecha no se puede interpretar, la columna queda como object
+    con el texto original en esa fila, para que se guarde tal cual.
+    """
+    fecha = pd.to_datetime(text, format='ISO8601', errors='coerce')
+    failed = fecha.isna() & (text != '')
+    if failed.any():
+        fecha[failed] = pd.to_datetime(text[failed], format='mixed', dayfirst=True, errors='coerce')
+        failed = fecha.isna() & (text != '')
+    fecha = fecha.astype(DATE_DTYPE)
+    if failed.any():
+        return fecha.astype(object).mask(failed, text)
+    return fecha
+
+def date_values(fecha):
+    """FechaActualizacion como fechas, con NaT donde quedó texto sin interpretar"""
+    if pd.api.types.is_datetime64_any_dtype(fecha):
+        return fecha
+    return pd.to_datetime(fecha.where(fecha.map(lambda value: isinstance(value, datetime))),
+                          errors='coerce').astype(DATE_DTYPE)
+
+def date_text(value):
+    """Fecha como texto, tal como se guarda; el texto sin interpretar queda igual"""
+    if is_missing(value):
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime(DATE_FORMAT)
+    return str(value)
+
+def schema_value(col, value):
+    """Convertir un valor suelto al tipo de su columna en el esquema"""
+    if col == 'FechaActualizacion':
+        return parse_dates(pd.Series([excel_text(value)])).iloc[0]
+    if col in TEXT_COLUMNS or col == 'Estatus':
+        return excel_text(value)
+    return value
+
+def to_text_frame(df):
+    """Copia con FechaActualizacion como texto, tal como se guarda en los
+    archivos y se muestra"""
+    fecha = df['FechaActualizacion']
+    if pd.api.types.is_datetime64_any_dtype(fecha):
+        fechas = fecha.dt.strftime(DATE_FORMAT).fillna('')
+    else:
+        fechas = fecha.map(date_text)
+    return df.assign(FechaActualizacion=fechas)
+
+def records_to_dicts(df):
+    """Registros como diccionarios con valores de texto (plantillas y JSON)"""
+    return to_text_frame(df).to_dict(orient='records')
+
+def is_missing(value):
+    """Celda vacía: None, NaN, NA o NaT"""
+    return value is None or value is pd.NA or value is pd.NaT or (isinstance(value, float) and pd.isna(value))
+
+def excel_text(value):
+    """Valor de una celda como texto, sin el '.0' que agrega Excel a los
+    números enteros"""
+    if is_missing(value):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+def cell_text(value):
+    """Valor de una celda como texto sin espacios y sin el '.0' que agrega Excel
+    a los números enteros"""
+    return excel_text(value).strip()
+
+def cedula_key(cedula):
+    """Clave de índice de una cédula"""
+    return cell_text(cedula)
+
+def normalize_phone(value):
+    """Teléfono en formato E.164 (+18095551234), o '' si no se puede saber
+    el número completo"""
+    text = cell_text(value)
+    digits = re.sub(r'\D', '', text)
+    if text.startswith('+'):
+        return f'+{digits}' if 8 <= len(digits) <= 15 else ''
+    if len(digits) == 10:
+        return f'+{DEFAULT_COUNTRY_CODE}{digits}'
+    if len(digits) == 11 and digits.startswith(DEFAULT_COUNTRY_CODE):
+        return f'+{digits}'
+    return ''
+
+def local_phone(phone):
+    """Número local (los últimos 7 dígitos) de un teléfono ya normalizado
+    del país por defecto, o ''"""
+    prefix = f'+{DEFAULT_COUNTRY_CODE}'
+    return phone[-7:] if phone.startswith(prefix) and len(phone) == len(prefix) + 10 else ''
+
+def normalize_cedula(value):
+    """Cédula solo con dígitos; si Excel la guardó como número y perdió los
+    ceros a la izquierda, se completan los 11 dígitos"""
+    text = cell_text(value)
+    digits = re.sub(r'\D', '', text)
+    if text.isdigit() and 9 <= len(digits) < 11:
+        return digits.zfill(11)
+    return digits
+
+def normalize_phones(series):
+    """normalize_phone aplicado a toda una columna"""
+    text = series.fillna('').str.strip()
+    digits = text.str.replace(r'\D', '', regex=True)
+    length = digits.str.len()
+    plus = text.str.startswith('+')
+    international = plus & length.between(8, 15)
+    with_code = ~plus & (length == 11) & digits.str.startswith(DEFAULT_COUNTRY_CODE)
+    national = ~plus & (length == 10)
+    result = pd.Series('', index=series.index, dtype=TEXT_DTYPE)
+    result = result.mask(international | with_code, '+' + digits)
+    return result.mask(national, f'+{DEFAULT_COUNTRY_CODE}' + digits)
+
+def local_phones(series):
+    """local_phone aplicado a una columna de teléfonos normalizados"""
+    national = series.str.fullmatch(rf'\+{DEFAULT_COUNTRY_CODE}\d{{10}}')
+    return series.where(national, '').str[-7:]
+
+def normalize_cedulas(series):
+    """normalize_cedula aplicado a toda una columna"""
+    text = series.fillna('').str.strip()
+    digits = text.str.replace(r'\D', '', regex=True)
+    lost_zeros = text.str.fullmatch(r'\d{9,10}')
+    return digits.mask(lost_zeros, digits.str.zfill(11)).astype(TEXT_DTYPE)
+
+def build_contact_keys(df):
+    """Columnas de CONTACT_KEY_COLUMNS normalizadas, con el mismo índice que df"""
+    return pd.DataFrame({
+        'Cedula': normalize_cedulas(df['Cedula']),
+        'Telefono': normalize_phones(df['Telefono']),
+        'Telefono2': normalize_phones(df['Telefono2']),
+    }, index=df.index)
+
+def fold_text(text):
+    """Texto en minúsculas y sin acentos para comparar búsquedas"""
+    text = unicodedata.normalize('NFKD', str(text).lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+def build_search_text(df):
+    """Columna de búsqueda: las columnas de SEARCH_COLUMNS unidas, en
+    minúsculas y sin acentos, calculada de forma vectorizada"""
+    text = df[SEARCH_COLUMNS[0]].astype(str)
+    for col in SEARCH_COLUMNS[1:]:
+        # El separador evita coincidencias que crucen de una columna a otra
+        text = text + '\x1f' + df[col].astype(str)
+    return fold_series(text).astype(EDITABLE_TEXT_DTYPE)
+
+def fold_series(series):
+    """fold_text aplicado a toda una columna de texto"""
+    return (series.str.lower()
+                  .str.normalize('NFKD')
+                  .str.replace('[\u0300-\u036f]', '', regex=True))
+
+class CampaignData:
+    """Registros de una campaña en memoria con un índice cédula -> filas.
+
+    El índice guarda las etiquetas de fila del DataFrame para cada cédula, de
+    modo que comprobar si existe, actualizar o eliminar un registro no recorre
+    la tabla. Agregar y eliminar filas crea un DataFrame nuevo, así quien esté
+    leyendo la versión anterior no ve cambios a medias.
+
+    search_text guarda por fila el texto de búsqueda ya normalizado,
+    contact_keys la cédula y los teléfonos normalizados (con
+    normalized_index: cédula normalizada -> filas) y status_counts cuántos
+    registros hay de cada estatus; todos se mantienen al día con cada cambio,
+    igual que size, la memoria ocupada (ver memory_usage).
+    """
+
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        self.next_label = len(self.df)
+        self.index = {}
+        for label, cedula in zip(self.df.index, self.df['Cedula']):
+            self.index.setdefault(cedula_key(cedula), []).append(label)
+        self.search_text = build_search_text(self.df)
+        self.contact_keys = build_contact_keys(self.df)
+        self.normalized_index = {}
+        for label, key in zip(self.df.index, self.contact_keys['Cedula']):
+            if key:
+                self.normalized_index.setdefault(key, []).append(label)
+        self.status_counts = Counter(self.df['Estatus'].value_counts().to_dict())
+        self.size = None
+
+    @classmethod
+    def empty(cls):
+        """Campaña sin registros"""
+        return cls(normalize_data(pd.DataFrame(columns=REQUIRED_COLUMNS)))
+
+    def __len__(self):
+        return len(self.df)
+
+    def __contains__(self, cedula):
+        return cedula_key(cedula) in self.index
+
+    def duplicates(self):
+        """Cédulas que aparecen en más de un registro"""
+        return {cedula: labels for cedula, labels in self.index.items() if len(labels) > 1}
+
+    def normalized_duplicates(self):
+        """Cédulas normalizadas que aparecen en más de un registro, aunque
+        estén escritas de forma distinta"""
+        return {key: labels for key, labels in self.normalized_index.items() if len(labels) > 1}
+
+    def find_cedula(self, cedula):
+        """Cédula (tal como está guardada) del registro que corresponde a
+        esta, aunque esté escrita de otra forma; None si no hay"""
+        if cedula in self:
+            return cell_text(cedula)
+        labels = self.normalized_index.get(normalize_cedula(cedula))
+        if not labels:
+            return None
+        return self.df.at[labels[0], 'Cedula']
+
+    def get(self, cedula):
+        """Registros (como diccionarios) con una cédula"""
+        labels = self.index.get(cedula_key(cedula), [])
+        # Celda por celda: con pocas filas es mucho más rápido que df.loc[labels]
+        return [{col: self._text_value(self.df.at[label, col]) for col in self.df.columns}
+                for label in labels]
+
+    @staticmethod
+    def _text_value(value):
+        """Valor de una celda como en records_to_dicts"""
+        if isinstance(value, datetime) or value is pd.NaT:
+            return date_text(value)
+        if pd.api.types.is_integer(value):
+            # La versión: entero de Python para poder pasarlo a JSON
+            return int(value)
+        return value
+
+    def search(self, query):
+        """Registros que contienen el texto buscado, sin distinguir
+        mayúsculas ni acentos"""
+        df, search_text = self.df, self.search_text
+        mask = search_text.str.contains(fold_text(query), regex=False)
+        # Un teléfono o cédula coincide aunque tenga otro formato (guiones,
+        # espacios, +1)
+        digits = re.sub(r'\D', '', query)
+        if len(digits) >= 4 and re.fullmatch(r'[\d\s().+-]+', query):
+            contact_keys = self.contact_keys
+            for col in CONTACT_KEY_COLUMNS:
+                mask = mask | contact_keys[col].str.contains(digits, regex=False).reindex(mask.index, fill_value=False)
+        return df[mask.reindex(df.index, fill_value=False)]
+
+    def stats(self):
+        """Total de registros y cantidad por estatus"""
+        stats = {'total': len(self.df)}
+        for key, estatus in STATUS_STATS.items():
+            stats[key] = int(self.status_counts.get(estatus, 0))
+        return stats
+
+    def update(self, cedula, values):
+        """Modificar las columnas indicadas de los registros de una cédula"""
+        labels = self.index.get(cedula_key(cedula), [])
+        values = {col: schema_value(col, value) for col, value in values.items()}
+        if 'Estatus' in values:
+            self._add_estatus([values['Estatus']])
+        for label in labels:
+            if 'Estatus' in values:
+                self.status_counts[self.df.at[label, 'Estatus']] -= 1
+                self.status_counts[values['Estatus']] += 1
+            for col, value in values.items():
+                if col in TEXT_COLUMNS:
+                    self._resize(self.df.at[label, col], value)
+                self.df.at[label, col] = value
+        if labels and any(col in SEARCH_COLUMNS for col in values):
+            # Celda por celda, como en get: son pocas filas
+            for label in labels:
+                text = fold_text('\x1f'.join(str(self.df.at[label, col]) for col in SEARCH_COLUMNS))
+                self._resize(self.search_text.at[label], text)
+                self.search_text.at[label] = text
+        if labels and any(col in CONTACT_KEY_COLUMNS for col in values):
+            self.contact_keys.loc[labels] = build_contact_keys(self.df.loc[labels])
+
+    def insert(self, row):
+        """Agregar un registro al final"""
+        self.insert_many(pd.DataFrame([row]))
+
+    def insert_many(self, rows_df):
+        """Agregar varios registros al final con una sola concatenación"""
+        if rows_df.empty:
+            return
+        labels = range(self.next_label, self.next_label + len(rows_df))
+        self.next_label += len(rows_df)
+        new_df = normalize_data(rows_df.reindex(columns=self.df.columns)).set_axis(labels)
+        # Mismas categorías de Estatus para que la concatenación siga siendo categórica
+        self._add_estatus(new_df['Estatus'].cat.categories)
+        new_df['Estatus'] = new_df['Estatus'].astype(self.df['Estatus'].dtype)
+        self.df = pd.concat([self.df, new_df]) if len(self.df) else new_df
+        new_search_text = build_search_text(new_df)
+        self.search_text = pd.concat([self.search_text, new_search_text])
+        new_keys = build_contact_keys(new_df)
+        self.contact_keys = pd.concat([self.contact_keys, new_keys])
+        if self.size is not None:
+            self.size += self._measure(new_df, new_search_text, new_keys)
+        for label, cedula, key in zip(labels, new_df['Cedula'], new_keys['Cedula']):
+            self.index.setdefault(cedula_key(cedula), []).append(label)
+            if key:
+                self.normalized_index.setdefault(key, []).append(label)
+        self.status_counts.update(new_df['Estatus'].value_counts().to_dict())
+
+    def _add_estatus(self, values):
+        """Agregar a las categorías de Estatus los valores que no estén"""
+        missing = [value for value in dict.fromkeys(values) if value not in self.df['Estatus'].cat.categories]
+        if missing:
+            self.df['Estatus'] = self.df['Estatus'].cat.add_categories(missing)
+
+    def apply(self, change):
+        """Aplicar un cambio descrito como diccionario (ver ExcelStorage).
+        Un insert de una cédula que ya existe se ignora, para poder repetir
+        cambios de un diario que quizá ya se habían guardado."""
+        if change['op'] == 'update':
+            self.update(change['cedula'], change['values'])
+        elif change['op'] == 'insert':
+            if change['row']['Cedula'] not in self:
+                self.insert(change['row'])
+        elif change['op'] == 'delete':
+            self.delete(change['cedula'])
+
+    def apply_changes(self, changes):
+        """Aplicar una lista de cambios, agrupando las altas seguidas"""
+        pending_rows = []
+        for change in changes:
+            if change['op'] == 'insert':
+                if change['row']['Cedula'] not in self:
+                    pending_rows.append(change['row'])
+                continue
+            if pending_rows:
+                self.insert_many(pd.DataFrame(pending_rows))
+                pending_rows = []
+            self.apply(change)
+        if pending_rows:
+            self.insert_many(pd.DataFrame(pending_rows))
+
+    def delete(self, cedula):
+        """Eliminar los registros de una cédula"""
+        self.remove_rows(self.index.get(cedula_key(cedula), []))
+
+    def remove_rows(self, labels):
+        """Eliminar filas concretas, por ejemplo un registro duplicado de una
+        cédula sin tocar los demás"""
+        labels = list(labels)
+        removed = set(labels)
+        for label in labels:
+            for index, key in ((self.index, cedula_key(self.df.at[label, 'Cedula'])),
+                               (self.normalized_index, self.contact_keys.at[label, 'Cedula'])):
+                remaining = [other for other in index.get(key, []) if other not in removed]
+                if remaining:
+                    index[key] = remaining
+                else:
+                    index.pop(key, None)
+        for estatus in self.df.loc[labels, 'Estatus']:
+            self.status_counts[estatus] -= 1
+        if self.size is not None and len(self.df):
+            # Lo que ocupa en promedio cada fila
+            self.size -= self.size * len(labels) // len(self.df)
+        self.df = self.df.drop(labels)
+        self.search_text = self.search_text.drop(labels)
+        self.contact_keys = self.contact_keys.drop(labels)
+
+    def memory_usage(self):
+        """Memoria aproximada ocupada por los registros. Se mide la primera
+        vez; después cada cambio suma o resta lo suyo, porque medir toda la
+        tabla de nuevo tarda demasiado para hacerlo en cada edición"""
+        if self.size is None:
+            self.size = self._measure(self.df, self.search_text, self.contact_keys)
+        return self.size
+
+    def _resize(self, old, new):
+        """Ajustar size al reemplazar el texto de una celda"""
+        if self.size is not None:
+            self.size += sys.getsizeof(str(new)) - sys.getsizeof(str(old))
+
+    @staticmethod
+    def _measure(df, search_text, contact_keys):
+        return (int(df.memory_usage(index=True, deep=True).sum())
+                + int(search_text.memory_usage(index=True, deep=True))
+                + int(contact_keys.memory_usage(index=True, deep=True).sum()))
+
+@timed('load_data')
 def load_data(campaign_name):
-    """Cargar datos del archivo Excel de una campaña específica"""
+    """Cargar los datos de una campaña específica.
+
+    Devuelve el CampaignData compartido en caché; para modificarlo hay que
+    tener campaign_write_lock y guardar los cambios con save_data.
+    """
     try:
-        file_path = get_campaign_file_path(campaign_name)
+        signature = storage.signature(campaign_name)
         
-        if os.path.exists(file_path):
-            df = pd.read_excel(file_path)
-            # Asegurar que las columnas necesarias existan
-            required_columns = ["Nombre", "Cedula", "Telefono", "Telefono2", "Estatus", "Comentario", "FechaActualizacion"]
-            for col in required_columns:
-                if col not in df.columns:
-                    if col == "FechaActualizacion":
-                        df[col] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                    else:
-                        df[col] = ""
-            # Convertir valores NaN a string vacío
-            df = df.fillna("")
-            return df
+        if signature is not None:
+            data = campaign_cache.get(campaign_name, signature)
+            if data is None:
+                with campaign_read_lock(campaign_name):
+                    signature = storage.signature(campaign_name)
+                    data = CampaignData(normalize_data(storage.read(campaign_name)))
+                    # Volver a aplicar los cambios de escritura diferida aún no guardados
+                    pending = write_behind.pending_changes(campaign_name)
+                    data.apply_changes(pending)
+                    # Dentro del candado, para que un cambio diferido hecho
+                    # justo después no quede fuera de lo que se pone en caché
+                    campaign_cache.put(campaign_name, signature, data)
+                duplicates = data.duplicates()
+                if duplicates:
+                    print(f"Advertencia: {len(duplicates)} cédulas duplicadas en {campaign_name}")
+                if not pending:
+                    record_stats_summary(campaign_name, signature, data.stats())
+            return data
         else:
-            # Crear DataFrame vacío
-            df = pd.DataFrame(columns=["Nombre", "Cedula", "Telefono", "Telefono2", "Estatus", "Comentario", "FechaActualizacion"])
-            df.to_excel(file_path, index=False)
-            return df
+            # Crear campaña vacía
+            with campaign_write_lock(campaign_name):
+                data = CampaignData.empty()
+                signature = storage.write(data.df, campaign_name)
+                campaign_cache.put(campaign_name, signature, data)
+                record_stats_summary(campaign_name, signature, data.stats())
+            return data
     except Exception as e:
         print(f"Error cargando datos para {campaign_name}: {e}")
-        return pd.DataFrame(columns=["Nombre", "Cedula", "Telefono", "Telefono2", "Estatus", "Comentario", "FechaActualizacion"])
+        return CampaignData.empty()
 
-def save_data(df, campaign_name):
-    """Guardar datos al archivo Excel de una campaña específica"""
+@timed('save_data')
+def save_data(data, campaign_name, changes=None):
+    """Guardar los datos de una campaña específica.
+
+    Si se indican los cambios aplicados, el motor puede persistir solo esas
+    filas en lugar de reescribir la campaña completa. Con WRITE_BEHIND esos
+    cambios solo se anotan en el diario y se guardan más tarde en lote.
+    """
     try:
-        file_path = get_campaign_file_path(campaign_name)
-        df.to_excel(file_path, index=False)
+        if changes is not None and WRITE_BEHIND:
+            write_behind.submit(campaign_name, changes)
+            campaign_cache.resize(campaign_name)
+            append_audit_events(campaign_name, data, changes)
+            search_index.apply_changes(campaign_name, changes)
+            dispatcher.apply_changes(campaign_name, changes)
+            return True
+        if changes is None:
+            signature = storage.write(data.df, campaign_name)
+            campaign_cache.put(campaign_name, signature, data)
+            # data ya incluye cualquier cambio diferido pendiente
+            write_behind.forget(campaign_name)
+            search_index.invalidate(campaign_name)
+            dispatcher.invalidate(campaign_name)
+        else:
+            previous = storage.signature(campaign_name)
+            signature = storage.write_changes(data.df, campaign_name, changes)
+            campaign_cache.touch(campaign_name, signature)
+            search_index.apply_changes(campaign_name, changes, previous, signature)
+            dispatcher.apply_changes(campaign_name, changes)
+        append_audit_events(campaign_name, data, changes)
+        record_stats_summary(campaign_name, signature, data.stats())
         return True
     except Exception as e:
         print(f"Error guardando datos para {campaign_name}: {e}")
+        campaign_cache.invalidate(campaign_name)
         return False
 
+def coalesce_changes(changes):
+    """Unir en una sola las actualizaciones de una misma cédula que no tienen
+    un alta o baja de esa cédula en medio"""
+    coalesced = []
+    last_update = {}
+    for change in changes:
+        if change['op'] == 'update':
+            key = cedula_key(change['cedula'])
+            previous = last_update.get(key)
+            if previous is not None:
+                previous['values'].update(change['values'])
+                continue
+            change = dict(change, values=dict(change['values']))
+            last_update[key] = change
+        else:
+            cedula = change['cedula'] if change['op'] == 'delete' else change['row']['Cedula']
+            last_update.pop(cedula_key(cedula), None)
+        coalesced.append(change)
+    return coalesced
+
+class WriteBehindQueue:
+    """Escritura diferida de los cambios de registros.
+
+    submit() anota cada cambio en el diario del proceso para esa campaña
+    (.journal/<proceso>/<archivo>.jsonl, una línea JSON por cambio, con
+    fsync) antes de confirmarlo; un hilo en segundo plano junta los cambios
+    pendientes de cada campaña, los guarda de una vez y borra ese diario. Al
+    terminar el proceso se guarda todo lo pendiente.
+
+    Mientras el proceso vive tiene tomado .journal/<proceso>.lock. Los
+    diarios de un proceso que terminó de golpe (su .lock ya no lo tiene
+    nadie) los guarda el primer proceso que arranca después, una sola vez.
+
+    Solo un proceso a la vez puede usar la escritura diferida con una
+    carpeta de campañas (tiene tomado .journal/activo.lock): los cambios
+    pendientes solo están en su memoria, así que otro proceso no los vería
+    al comprobar la versión de un registro y podría aceptar una edición que
+    luego se pisa. start() falla si otro proceso ya la está usando.
+    """
+
+    def __init__(self, interval, max_pending):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = {}
+        self.first_pending = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.stopped = False
+        self.token = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        self.owner_locks = {}
+
+    def start(self):
+        """Arrancar el hilo (una sola vez) y, la primera vez que se usa una
+        carpeta de campañas, tomarla para este proceso y recuperar los
+        diarios de otros procesos. Lanza RuntimeError si otro proceso ya usa
+        la escritura diferida con esa carpeta."""
+        journal_dir = os.path.join(CAMPAIGNS_DIR, JOURNAL_DIR)
+        with self.lock:
+            if journal_dir in self.owner_locks:
+                return
+            active_lock = FileLock(os.path.join(journal_dir, WRITE_BEHIND_LOCK_FILE))
+            if not active_lock.acquire(blocking=False):
+                raise RuntimeError(f'Error: Otro proceso ya usa la escritura diferida (CRM_WRITE_BEHIND=1) '
+                                   f'en {CAMPAIGNS_DIR}; con varios workers hay que desactivarla')
+            owner_lock = FileLock(os.path.join(journal_dir, f'{self.token}.lock'))
+            owner_lock.acquire()
+            self.owner_locks[journal_dir] = (active_lock, owner_lock)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='write-behind', daemon=True)
+                self.thread.start()
+                atexit.register(self.stop)
+        self.recover(journal_dir)
+
+    def journal_path(self, campaign_name):
+        file_name = os.path.basename(get_campaign_file_path(campaign_name))
+        return os.path.join(CAMPAIGNS_DIR, JOURNAL_DIR, self.token, f'{file_name}.jsonl')
+
+    def submit(self, campaign_name, changes):
+        """Anotar cambios ya aplicados en memoria (con campaign_write_lock tomado)"""
+        self.start()
+        journal_path = self.journal_path(campaign_name)
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        with open(journal_path, 'a', encoding='utf-8') as f:
+            for change in changes:
+                f.write(json.dumps(dict(change, campaign=campaign_name), ensure_ascii=False, default=str) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        with self.lock:
+            self.pending.setdefault(campaign_name, []).extend(changes)
+            self.first_pending.setdefault(campaign_name, time.monotonic())
+            if len(self.pending[campaign_name]) >= self.max_pending:
+                self.wakeup.set()
+
+    def pending_changes(self, campaign_name):
+        """Cambios de una campaña que todavía no se han guardado"""
+        with self.lock:
+            return list(self.pending.get(campaign_name, []))
+
+    def pending_count(self, campaign_name):
+        """Cuántos cambios de una campaña faltan por guardar"""
+        with self.lock:
+            return len(self.pending.get(campaign_name, []))
+
+    def run(self):
+        while not self.stopped:
+            self.wakeup.wait(self.interval / 2)
+            self.wakeup.clear()
+            now = time.monotonic()
+            with self.lock:
+                due = [name for name, changes in self.pending.items()
+                       if len(changes) >= self.max_pending or now - self.first_pending[name] >= self.interval]
+            for campaign_name in due:
+                self.flush_campaign(campaign_name)
+
+    def flush_campaign(self, campaign_name):
+        """Guardar los cambios pendientes de una campaña"""
+        with campaign_write_lock(campaign_name):
+            changes = self.pending_changes(campaign_name)
+            if not changes:
+                return True
+            try:
+                data = load_data(campaign_name)
+                previous = storage.signature(campaign_name)
+                signature = storage.write_changes(data.df, campaign_name, coalesce_changes(changes))
+                campaign_cache.touch(campaign_name, signature)
+                search_index.touch(campaign_name, previous, signature)
+                record_stats_summary(campaign_name, signature, data.stats())
+            except Exception as e:
+                print(f"Error guardando cambios pendientes de {campaign_name}: {e}")
+                return False
+            self.forget(campaign_name)
+            return True
+
+    def flush(self):
+        """Guardar ya todos los cambios pendientes"""
+        with self.lock:
+            campaign_names = list(self.pending)
+        return all([self.flush_campaign(campaign_name) for campaign_name in campaign_names])
+
+    def forget(self, campaign_name):
+        """Descartar los cambios pendientes de una campaña y el diario de
+        este proceso; los de otros procesos no se tocan"""
+        with self.lock:
+            self.pending.pop(campaign_name, None)
+            self.first_pending.pop(campaign_name, None)
+        journal_path = self.journal_path(campaign_name)
+        if os.path.exists(journal_path):
+            os.remove(journal_path)
+
+    def stop(self):
+        """Detener el hilo guardando todo lo pendiente y soltar los diarios"""
+        self.stopped = True
+        self.wakeup.set()
+        self.flush()
+        with self.lock:
+            owner_locks, self.owner_locks = self.owner_locks, {}
+        for journal_dir, (active_lock, owner_lock) in owner_locks.items():
+            owner_lock.release()
+            self.discard_owner(journal_dir, self.token)
+            active_lock.release()
+
+    @staticmethod
+    def discard_owner(journal_dir, token):
+        """Borrar la carpeta de diarios de un proceso, si ya está vacía, y su .lock"""
+        token_dir = os.path.join(journal_dir, token)
+        try:
+            if os.path.isdir(token_dir):
+                os.rmdir(token_dir)
+            os.remove(os.path.join(journal_dir, f'{token}.lock'))
+        except OSError:
+            pass
+
+    def recover(self, journal_dir):
+        """Guardar los diarios que dejaron procesos que terminaron de golpe.
+
+        Solo se recupera la carpeta de un proceso cuyo .lock se puede tomar,
+        es decir, que ya no existe; si dos procesos arrancan a la vez, solo
+        uno de los dos la consigue.
+        """
+        if not os.path.isdir(journal_dir):
+            return
+        for token in sorted(os.listdir(journal_dir)):
+            token_dir = os.path.join(journal_dir, token)
+            if token == self.token or not os.path.isdir(token_dir):
+                continue
+            owner_lock = FileLock(os.path.join(journal_dir, f'{token}.lock'))
+            if not owner_lock.acquire(blocking=False):
+                continue
+            try:
+                for file_name in sorted(os.listdir(token_dir)):
+                    journal_path = os.path.join(token_dir, file_name)
+                    if self.recover_journal(journal_path):
+                        os.remove(journal_path)
+            finally:
+                owner_lock.release()
+            self.discard_owner(journal_dir, token)
+
+    def recover_journal(self, journal_path):
+        """Aplicar y guardar los cambios de un diario ajeno, con el candado de
+        su campaña; devuelve False si no se pudieron guardar"""
+        changes_by_campaign = {}
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    change = json.loads(line)
+                except ValueError:
+                    # Última línea incompleta: ese cambio nunca se confirmó
+                    continue
+                changes_by_campaign.setdefault(change.pop('campaign'), []).append(change)
+        for campaign_name, changes in changes_by_campaign.items():
+            with campaign_write_lock(campaign_name):
+                if storage.signature(campaign_name) is None:
+                    # La campaña se eliminó después
+                    continue
+                try:
+                    data = load_data(campaign_name)
+                    data.apply_changes(changes)
+                    previous = storage.signature(campaign_name)
+                    signature = storage.write_changes(data.df, campaign_name, coalesce_changes(changes))
+                    campaign_cache.touch(campaign_name, signature)
+                    search_index.apply_changes(campaign_name, changes, previous, signature)
+                    dispatcher.apply_changes(campaign_name, changes)
+                    record_stats_summary(campaign_name, signature, data.stats())
+                except Exception as e:
+                    print(f"Error recuperando el diario {os.path.basename(journal_path)} de {campaign_name}: {e}")
+                    return False
+        return True
+
+write_behind = WriteBehindQueue(FLUSH_INTERVAL, FLUSH_MAX_PENDING)
+
+class StateDatabase:
+    """Base SQLite con el estado que comparten todos los procesos de la
+    aplicación (por ejemplo, los workers de gunicorn), con cualquier motor de
+    almacenamiento.
+
+    Cada proceso escribe solo las filas que cambia, así no pisa lo que
+    guardó otro.
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS stats ('
+        'campaign TEXT PRIMARY KEY, signature TEXT NOT NULL, stats TEXT NOT NULL)',
+        'CREATE TABLE IF NOT EXISTS leases ('
+        'campaign TEXT NOT NULL, cedula TEXT NOT NULL, agent TEXT NOT NULL, '
+        'expires REAL NOT NULL, PRIMARY KEY (campaign, cedula))',
+    ]
+    SYNCHRONOUS = 'NORMAL'
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.local = threading.local()
+
+    def connection(self):
+        """Conexión SQLite propia de cada hilo"""
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            ensure_campaigns_dir()
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'PRAGMA synchronous={self.SYNCHRONOUS}')
+            with conn:
+                for statement in self.SCHEMA:
+                    conn.execute(statement)
+            self.local.conn = conn
+        return conn
+
+state_db = StateDatabase(os.path.join(CAMPAIGNS_DIR, STATE_DB_FILE))
+
+class AuditDatabase(StateDatabase):
+    """Historial de cambios de todas las campañas, al que solo se agregan filas.
+
+    Cada alta, edición o baja es una fila de events con la cédula como
+    columna indexada, así el historial de un registro es una sola consulta.
+    Una foto ('snapshot') de la campaña agrega una fila por registro y anota
+    en snapshots qué filas la forman; con la última foto y los eventos
+    posteriores se reconstruye el estado actual aunque el Excel se dañe. Los
+    cambios hechos al archivo fuera de la aplicación no quedan en el
+    historial. Cada escritura se confirma en disco (synchronous=FULL).
+    """
+
+    SCHEMA = [
+        'CREATE TABLE IF NOT EXISTS events ('
+        'id INTEGER PRIMARY KEY, campaign TEXT NOT NULL, cedula TEXT NOT NULL, event TEXT NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS idx_events_campaign_cedula ON events (campaign, cedula)',
+        'CREATE TABLE IF NOT EXISTS snapshots ('
+        'id INTEGER PRIMARY KEY, campaign TEXT NOT NULL, first_event INTEGER NOT NULL, '
+        'last_event INTEGER NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS idx_snapshots_campaign ON snapshots (campaign)',
+    ]
+    SYNCHRONOUS = 'FULL'
+
+audit_db = AuditDatabase(os.path.join(CAMPAIGNS_DIR, AUDIT_DB_FILE))
+
+def event_cedula(event):
+    """Clave de la cédula a la que se refiere un evento del historial"""
+    if event['op'] in ('snapshot', 'insert'):
+        return cedula_key(event['row']['Cedula'])
+    return cedula_key(event['cedula'])
+
+# Campañas a las que les faltan cambios en el historial porque no se
+# pudieron anotar; la próxima vez se anota una foto completa
+audit_gaps = set()
+
+def append_audit_events(campaign_name, data, changes=None):
+    """Agregar al historial los cambios ya aplicados y guardados de data
+    (con campaign_write_lock tomado). Sin cambios, si la campaña aún no
+    tiene historial o si le faltan cambios, se anota primero una foto de
+    todos los registros; los cambios que ya estén en la foto se pueden
+    repetir sin efecto al reconstruir.
+
+    Un error del historial se informa sin lanzar la excepción: los datos ya
+    se guardaron y la edición no debe aparecer como fallida.
+    """
+    try:
+        write_audit_events(campaign_name, data, changes)
+        audit_gaps.discard(campaign_name)
+    except sqlite3.Error as e:
+        print(f"Error anotando el historial de {campaign_name}: {e}")
+        audit_gaps.add(campaign_name)
+
+def write_audit_events(campaign_name, data, changes):
+    """Escribir la foto (si hace falta) y los cambios en la base del historial"""
+    now = datetime.now().strftime(DATE_FORMAT)
+    conn = audit_db.connection()
+    with conn:
+        if changes is None or campaign_name in audit_gaps or conn.execute(
+                'SELECT 1 FROM snapshots WHERE campaign = ? LIMIT 1', (campaign_name,)).fetchone() is None:
+            rows = [{'ts': now, 'op': 'snapshot', 'row': row} for row in records_to_dicts(data.df)]
+            insert_audit_events(conn, campaign_name, rows)
+            # La transacción tiene la base tomada: las filas de la foto son
+            # las últimas len(rows), seguidas
+            last_event = conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+            conn.execute(
+                'INSERT INTO snapshots (campaign, first_event, last_event) VALUES (?, ?, ?)',
+                (campaign_name, last_event - len(rows) + 1, last_event)
+            )
+        insert_audit_events(conn, campaign_name, [dict(change, ts=now) for change in changes or []])
+
+def insert_audit_events(conn, campaign_name, events):
+    """Agregar eventos al historial dentro de una transacción ya abierta"""
+    conn.executemany(
+        'INSERT INTO events (campaign, cedula, event) VALUES (?, ?, ?)',
+        ((campaign_name, event_cedula(event), json.dumps(event, ensure_ascii=False, default=str))
+         for event in events)
+    )
+
+def record_history(campaign_name, cedula):
+    """Eventos del historial que afectan a una cédula"""
+    rows = audit_db.connection().execute(
+        'SELECT event FROM events WHERE campaign = ? AND cedula = ? ORDER BY id',
+        (campaign_name, cedula_key(cedula))
+    )
+    return [json.loads(event) for event, in rows]
+
+def replay_audit_log(campaign_name):
+    """Reconstruir los registros de una campaña a partir de su última foto
+    y los eventos posteriores; None si no tiene historial"""
+    conn = audit_db.connection()
+    snapshot = conn.execute(
+        'SELECT first_event, last_event FROM snapshots WHERE campaign = ? ORDER BY id DESC LIMIT 1',
+        (campaign_name,)
+    ).fetchone()
+    if snapshot is None:
+        return None
+    first_event, last_event = snapshot
+    events = conn.execute(
+        'SELECT id, event FROM events WHERE campaign = ? AND id >= ? ORDER BY id',
+        (campaign_name, first_event)
+    )
+    rows = []
+    changes = []
+    for event_id, event in events:
+        if event_id <= last_event:
+            rows.append(json.loads(event)['row'])
+        else:
+            changes.append(json.loads(event))
+    data = CampaignData(normalize_data(pd.DataFrame(rows, columns=STORED_COLUMNS)))
+    data.apply_changes(changes)
+    return data, len(changes)
+
+def forget_audit_log(campaign_name):
+    """Borrar el historial de una campaña eliminada"""
+    conn = audit_db.connection()
+    with conn:
+        conn.execute('DELETE FROM events WHERE campaign = ?', (campaign_name,))
+        conn.execute('DELETE FROM snapshots WHERE campaign = ?', (campaign_name,))
+
+# Resumen de estadísticas por campaña junto con la firma de los datos con que
+# se calculó, para mostrar totales sin cargar cada campaña
+
+def load_stats_summary(campaign_name=None):
+    """Resumen guardado: {campaña: {'signature': [...], 'stats': {...}}}, solo
+    de campaign_name si se indica"""
+    query = 'SELECT campaign, signature, stats FROM stats'
+    params = ()
+    if campaign_name is not None:
+        query += ' WHERE campaign = ?'
+        params = (campaign_name,)
+    try:
+        rows = state_db.connection().execute(query, params).fetchall()
+    except sqlite3.Error as e:
+        print(f"Error leyendo estadísticas: {e}")
+        return {}
+    return {name: {'signature': json.loads(signature), 'stats': json.loads(stats)}
+            for name, signature, stats in rows}
+
+def record_stats_summary(campaign_name, signature, stats):
+    """Actualizar las estadísticas guardadas de una campaña"""
+    conn = state_db.connection()
+    try:
+        with conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO stats (campaign, signature, stats) VALUES (?, ?, ?)',
+                (campaign_name, json.dumps(list(signature)), json.dumps(stats))
+            )
+    except sqlite3.Error as e:
+        print(f"Error guardando estadísticas: {e}")
+
+def forget_stats_summary(campaign_name):
+    """Quitar una campaña del resumen de estadísticas"""
+    conn = state_db.connection()
+    try:
+        with conn:
+            conn.execute('DELETE FROM stats WHERE campaign = ?', (campaign_name,))
+    except sqlite3.Error as e:
+        print(f"Error guardando estadísticas: {e}")
+
+@timed('campaign_stats')
+def get_campaign_stats(campaign_name):
+    """Estadísticas de una campaña sin recorrer sus registros.
+
+    Usa la campaña en caché si está cargada, o el resumen guardado si sigue
+    correspondiendo a la versión en disco; solo si no, carga la campaña.
+    """
+    signature = storage.signature(campaign_name)
+    if signature is not None:
+        data = campaign_cache.peek(campaign_name, signature)
+        if data is not None:
+            return data.stats()
+        entry = load_stats_summary(campaign_name).get(campaign_name)
+        if entry is not None and entry['signature'] == list(signature):
+            return entry['stats']
+    return load_data(campaign_name).stats()
+
+def name_tokens(name):
+    """Palabras de un nombre en minúsculas y sin acentos"""
+    return set(re.findall(r'[a-z0-9]{2,}', fold_text(cell_text(name))))
+
+def positions_by_value(series):
+    """Diccionario valor -> posiciones (el índice de la serie) en que aparece.
+    La serie debe venir ordenada por posición."""
+    series = series[series.notna() & (series != '')]
+    postings = {}
+    for value, position in zip(series.tolist(), series.index.tolist()):
+        positions = postings.setdefault(value, [])
+        # Un mismo valor dos veces en un registro (p. ej. Telefono = Telefono2)
+        if not positions or positions[-1] != position:
+            positions.append(position)
+    return postings
+
+class SearchIndex:
+    """Índice invertido de todas las campañas para la búsqueda global.
+
+    Por campaña guarda los registros indexados (Nombre, Cedula, Telefono,
+    Telefono2) y dos diccionarios de posiciones: cédula y teléfonos
+    normalizados (normalize_cedula y normalize_phone, los mismos que usa la
+    búsqueda de duplicados, más el número local de 7 dígitos de cada
+    teléfono nacional) y palabras del nombre. Cada campaña se persiste
+    en campañas/.indice junto con la firma de los datos; solo se reconstruye
+    la campaña cuya firma cambió, y las altas y bajas hechas desde la
+    aplicación se aplican al índice sin reconstruirlo.
+    """
+
+    # Cambia cuando cambian las claves; los índices guardados con otra
+    # versión se reconstruyen
+    VERSION = 3
+
+    def __init__(self):
+        self.entries = {}
+        self.dirty = set()
+        self.last_save = time.monotonic()
+        self.lock = threading.Lock()
+
+    def index_path(self, campaign_name):
+        file_name = os.path.basename(get_campaign_file_path(campaign_name))
+        return os.path.join(CAMPAIGNS_DIR, SEARCH_INDEX_DIR, f'{file_name}.json')
+
+    @staticmethod
+    def _add(entry, record):
+        position = len(entry['records'])
+        entry['records'].append(record)
+        for key in SearchIndex._keys(record):
+            entry['keys'].setdefault(key, []).append(position)
+        for token in name_tokens(record[0]):
+            entry['tokens'].setdefault(token, []).append(position)
+
+    @staticmethod
+    def _keys(record):
+        """Claves normalizadas de un registro indexado"""
+        nombre, cedula, telefono, telefono2 = record
+        phones = {normalize_phone(telefono), normalize_phone(telefono2)}
+        return ({normalize_cedula(cedula)} | phones | {local_phone(phone) for phone in phones}) - {''}
+
+    @staticmethod
+    def _remove(entry, cedula):
+        key = cedula_key(cedula)
+        normalized = normalize_cedula(cedula)
+        candidates = entry['keys'].get(normalized, []) if normalized else range(len(entry['records']))
+        for position in list(candidates):
+            record = entry['records'][position]
+            if record is None or cedula_key(record[1]) != key:
+                continue
+            entry['records'][position] = None
+            for postings, keys in ((entry['keys'], SearchIndex._keys(record)),
+                                   (entry['tokens'], name_tokens(record[0]))):
+                for item in keys:
+                    if position in postings.get(item, []):
+                        postings[item].remove(position)
+                        if not postings[item]:
+                            del postings[item]
+
+    def build(self, campaign_name, data, signature):
+        """Indexar una campaña completa"""
+        df = data.df[INDEX_COLUMNS].map(cell_text).reset_index(drop=True)
+        # Mismas posiciones que df: contact_keys tiene el índice de data.df
+        keys = data.contact_keys[CONTACT_KEY_COLUMNS].reset_index(drop=True)
+        for col in ('Telefono', 'Telefono2'):
+            keys[f'{col}Local'] = local_phones(keys[col])
+        keys = keys.stack()
+        keys.index = keys.index.get_level_values(0)
+        tokens = fold_series(df['Nombre']).str.findall(r'[a-z0-9]{2,}').explode()
+        entry = {
+            'version': self.VERSION,
+            'signature': list(signature),
+            'records': df.values.tolist(),
+            'keys': positions_by_value(keys),
+            'tokens': positions_by_value(tokens)
+        }
+        with self.lock:
+            self.entries[campaign_name] = entry
+            self.dirty.add(campaign_name)
+        return entry
+
+    def load(self, campaign_name):
+        """Leer el índice guardado de una campaña"""
+        try:
+            with open(self.index_path(campaign_name), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry.get('version') != self.VERSION:
+            return None
+        with self.lock:
+            return self.entries.setdefault(campaign_name, entry)
+
+    def save(self, force=False):
+        """Guardar las campañas con cambios, como mucho cada SEARCH_INDEX_SAVE_INTERVAL segundos"""
+        if not force and time.monotonic() - self.last_save < SEARCH_INDEX_SAVE_INTERVAL:
+            return
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            self.last_save = time.monotonic()
+            entries = {name: self.entries[name] for name in dirty if name in self.entries}
+        for campaign_name, entry in entries.items():
+            index_path = self.index_path(campaign_name)
+            try:
+                os.makedirs(os.path.dirname(index_path), exist_ok=True)
+                with atomic_write(index_path) as tmp_path:
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        with self.lock:
+                            json.dump(entry, f, ensure_ascii=False)
+            except OSError as e:
+                print(f"Error guardando índice de búsqueda de {campaign_name}: {e}")
+
+    def refresh(self):
+        """Reconstruir las campañas cuyo índice no corresponde a sus datos y
+        quitar las que ya no están en la lista"""
+        campaigns = campaign_registry.names()
+        rebuilt = False
+        for campaign_name in campaigns:
+            signature = storage.signature(campaign_name)
+            entry = self.entries.get(campaign_name) or self.load(campaign_name)
+            if signature is None or entry is None or entry['signature'] != list(signature):
+                data = load_data(campaign_name)
+                self.build(campaign_name, data, storage.signature(campaign_name))
+                rebuilt = True
+        with self.lock:
+            for campaign_name in set(self.entries) - set(campaigns):
+                del self.entries[campaign_name]
+        self.save(force=rebuilt)
+
+    def apply_changes(self, campaign_name, changes, previous=None, signature=None):
+        """Aplicar al índice los cambios guardados de una campaña.
+
+        Si se indica la firma anterior y el índice no estaba al día con ella,
+        se descarta para reconstruirlo en la próxima búsqueda.
+        """
+        with self.lock:
+            entry = self.entries.get(campaign_name)
+            if entry is None:
+                return
+            if previous is not None and entry['signature'] != list(previous):
+                del self.entries[campaign_name]
+                return
+            for change in changes:
+                if change['op'] == 'insert':
+                    self._add(entry, [cell_text(change['row'].get(col, '')) for col in INDEX_COLUMNS])
+                elif change['op'] == 'delete':
+                    self._remove(entry, change['cedula'])
+                elif set(change['values']) & set(INDEX_COLUMNS):
+                    del self.entries[campaign_name]
+                    return
+            if signature is not None:
+                entry['signature'] = list(signature)
+            self.dirty.add(campaign_name)
+
+    def touch(self, campaign_name, previous, signature):
+        """Actualizar la firma tras guardar cambios que el índice ya tenía"""
+        self.apply_changes(campaign_name, [], previous, signature)
+
+    def invalidate(self, campaign_name):
+        """Descartar el índice de una campaña"""
+        with self.lock:
+            self.entries.pop(campaign_name, None)
+            self.dirty.discard(campaign_name)
+        index_path = self.index_path(campaign_name)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+
+    def search(self, query, limit=GLOBAL_SEARCH_LIMIT):
+        """Buscar por palabras del nombre o por cédula o teléfono en todas
+        las campañas. La cédula y el teléfono tienen que estar completos
+        (con cualquier formato); de un teléfono nacional basta el número
+        local de 7 dígitos. Una parte de la cédula no encuentra nada."""
+        keys = {normalize_cedula(query), normalize_phone(query)} - {''}
+        tokens = name_tokens(query)
+        use_keys = len(re.sub(r'\D', '', query)) >= 7 and not re.search(r'[a-zA-Z]', query)
+        if not use_keys and not tokens:
+            return [], 0
+        results = []
+        total = 0
+        with self.lock:
+            for campaign_name, entry in self.entries.items():
+                if use_keys:
+                    positions = set().union(*(entry['keys'].get(key, []) for key in keys))
+                else:
+                    postings = sorted((entry['tokens'].get(token, []) for token in tokens), key=len)
+                    positions = set(postings[0]).intersection(*postings[1:])
+                for position in sorted(positions):
+                    record = entry['records'][position]
+                    if record is None:
+                        continue
+                    total += 1
+                    if len(results) < limit:
+                        results.append(dict(zip(INDEX_COLUMNS, record), campaign=campaign_name))
+        return results, total
+
+search_index = SearchIndex()
+# Por nombre, ya que configure_app puede reemplazar el índice
+atexit.register(lambda: search_index.save(True))
+
+class Dispatcher:
+    """Reparto de contactos Pendiente a los agentes, con reservas por tiempo.
+
+    Cada campaña tiene una cola de prioridad (heap) con sus pendientes,
+    primero los de FechaActualizacion más antigua. Asignar el siguiente
+    contacto saca de la cola en O(log n) en lugar de recorrer la tabla; las
+    entradas que ya no son Pendiente se descartan al salir. La reserva se
+    libera cuando se guarda el resultado de la llamada (cualquier estatus;
+    si sigue Pendiente vuelve al final de la cola), cuando el agente la
+    suelta o cuando vence.
+
+    Las reservas se guardan en la tabla leases de la base de estado
+    (StateDatabase), que comparten todos los procesos: reservar es un INSERT
+    que solo uno consigue, así dos workers no entregan el mismo contacto. La
+    cola es de cada proceso; un contacto reservado en otro proceso espera en
+    un segundo heap hasta que vence su reserva.
+    """
+
+    def __init__(self, lease_seconds):
+        self.lease_seconds = lease_seconds
+        self.entries = {}
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def _entry(self, campaign_name, data):
+        """Cola de la campaña, reconstruida si los datos se volvieron a cargar"""
+        entry = self.entries.get(campaign_name)
+        if entry is None:
+            entry = self.entries[campaign_name] = {'data': None, 'queue': [], 'waiting': []}
+        if entry['data'] is not data:
+            pending = data.df[data.df['Estatus'] == 'Pendiente']
+            # En segundos; NaT queda como el menor entero, es decir, primero
+            fechas = date_values(pending['FechaActualizacion']).to_numpy().astype('int64').tolist()
+            keys = [cedula_key(cedula) for cedula in pending['Cedula']]
+            entry['queue'] = list(zip(fechas, pending.index.tolist(), keys))
+            heapq.heapify(entry['queue'])
+            entry['waiting'] = []
+            entry['data'] = data
+            self.sequence = max(self.sequence, data.next_label)
+        return entry
+
+    def _is_pending(self, data, key):
+        labels = data.index.get(key)
+        return bool(labels) and data.df.at[labels[0], 'Estatus'] == 'Pendiente'
+
+    def _priority(self, data, key):
+        """Posición en la cola de un contacto, la misma que le da _entry"""
+        label = data.index[key][0]
+        fecha = date_values(data.df.loc[[label], 'FechaActualizacion']).to_numpy().astype('int64')[0]
+        return (int(fecha), label, key)
+
+    def _expire(self, entry, now):
+        """Devolver a la cola los contactos cuya reserva venció"""
+        while entry['waiting'] and entry['waiting'][0][0] <= now:
+            heapq.heappush(entry['queue'], heapq.heappop(entry['waiting'])[1])
+
+    def _push(self, entry, key):
+        self.sequence += 1
+        now = pd.Timestamp.now().value // 10**9
+        heapq.heappush(entry['queue'], (now, self.sequence, key))
+
+    @staticmethod
+    def _claim(conn, campaign_name, key, agent, now, expires):
+        """Reservar un contacto si nadie lo tiene; devuelve el vencimiento de
+        la reserva de otro agente si ya estaba reservado"""
+        with conn:
+            conn.execute('DELETE FROM leases WHERE campaign = ? AND expires <= ?', (campaign_name, now))
+            inserted = conn.execute(
+                'INSERT OR IGNORE INTO leases (campaign, cedula, agent, expires) VALUES (?, ?, ?, ?)',
+                (campaign_name, key, agent, expires)
+            ).rowcount
+            if inserted:
+                return None
+            return conn.execute(
+                'SELECT expires FROM leases WHERE campaign = ? AND cedula = ?', (campaign_name, key)
+            ).fetchone()[0]
+
+    def next(self, campaign_name, agent):
+        """Reservar para el agente el siguiente contacto pendiente.
+
+        Si el agente ya tiene un contacto reservado en la campaña se le
+        devuelve el mismo. Devuelve (registro, reserva) o (None, None).
+        """
+        data = load_data(campaign_name)
+        conn = state_db.connection()
+        with get_campaign_lock(campaign_name), self.lock:
+            entry = self._entry(campaign_name, data)
+            now = time.time()
+            self._expire(entry, now)
+            
+            leased = conn.execute(
+                'SELECT cedula, expires FROM leases WHERE campaign = ? AND agent = ? AND expires > ?',
+                (campaign_name, agent, now)
+            ).fetchall()
+            for key, expires in leased:
+                if self._is_pending(data, key):
+                    return data.get(key)[0], self._lease_info(key, agent, expires)
+                self._delete_leases(campaign_name, key)
+            
+            while entry['queue']:
+                priority = heapq.heappop(entry['queue'])
+                key = priority[2]
+                if not self._is_pending(data, key):
+                    continue
+                expires = now + self.lease_seconds
+                other_expires = self._claim(conn, campaign_name, key, agent, now, expires)
+                if other_expires is not None:
+                    heapq.heappush(entry['waiting'], (other_expires, priority))
+                    continue
+                heapq.heappush(entry['waiting'], (expires, priority))
+                return data.get(key)[0], self._lease_info(key, agent, expires)
+            return None, None
+
+    def release(self, campaign_name, cedula, agent):
+        """Soltar la reserva que tiene el agente y devolver el contacto a la cola"""
+        key = cedula_key(cedula)
+        conn = state_db.connection()
+        with conn:
+            if not conn.execute(
+                'DELETE FROM leases WHERE campaign = ? AND cedula = ? AND agent = ? AND expires > ?',
+                (campaign_name, key, agent, time.time())
+            ).rowcount:
+                return False
+        with self.lock:
+            entry = self.entries.get(campaign_name)
+            if entry is not None and entry['data'] is not None and self._is_pending(entry['data'], key):
+                heapq.heappush(entry['queue'], self._priority(entry['data'], key))
+        return True
+
+    def leases(self, campaign_name):
+        """Reservas vigentes de una campaña"""
+        rows = state_db.connection().execute(
+            'SELECT cedula, agent, expires FROM leases WHERE campaign = ? AND expires > ? ORDER BY expires',
+            (campaign_name, time.time())
+        ).fetchall()
+        return [self._lease_info(key, agent, expires) for key, agent, expires in rows]
+
+    def remaining(self, campaign_name, data):
+        """Pendientes que no están reservados"""
+        leased = state_db.connection().execute(
+            'SELECT COUNT(*) FROM leases WHERE campaign = ? AND expires > ?', (campaign_name, time.time())
+        ).fetchone()[0]
+        return max(0, data.status_counts.get('Pendiente', 0) - leased)
+
+    def apply_changes(self, campaign_name, changes):
+        """Actualizar la cola y las reservas con los cambios guardados de una campaña"""
+        released = []
+        with self.lock:
+            entry = self.entries.get(campaign_name)
+            for change in changes:
+                if change['op'] == 'insert':
+                    if entry is not None and change['row'].get('Estatus') == 'Pendiente':
+                        self._push(entry, cedula_key(change['row']['Cedula']))
+                elif change['op'] == 'delete':
+                    released.append(cedula_key(change['cedula']))
+                elif 'Estatus' in change['values']:
+                    # El agente guardó el resultado de la llamada, aunque lo
+                    # deje Pendiente: si no, /next le devolvería el mismo
+                    key = cedula_key(change['cedula'])
+                    released.append(key)
+                    if change['values']['Estatus'] == 'Pendiente' and entry is not None:
+                        self._push(entry, key)
+        if released:
+            self._delete_leases(campaign_name, *released)
+
+    def invalidate(self, campaign_name):
+        """Reconstruir la cola la próxima vez (las reservas no cambian)"""
+        with self.lock:
+            entry = self.entries.get(campaign_name)
+            if entry is not None:
+                entry['data'] = None
+
+    def forget(self, campaign_name):
+        """Descartar la cola y las reservas de una campaña"""
+        with self.lock:
+            self.entries.pop(campaign_name, None)
+        self._delete_leases(campaign_name)
+
+    @staticmethod
+    def _delete_leases(campaign_name, *keys):
+        """Borrar las reservas de unas cédulas, o todas las de la campaña"""
+        conn = state_db.connection()
+        with conn:
+            if keys:
+                conn.executemany('DELETE FROM leases WHERE campaign = ? AND cedula = ?',
+                                 [(campaign_name, key) for key in keys])
+            else:
+                conn.execute('DELETE FROM leases WHERE campaign = ?', (campaign_name,))
+
+    @staticmethod
+    def _lease_info(key, agent, expires):
+        return {
+            'cedula': key,
+            'agent': agent,
+            'expires': datetime.fromtimestamp(expires).strftime(DATE_FORMAT)
+        }
+
+dispatcher = Dispatcher(LEASE_SECONDS)
+
+def get_view_args(source):
+    """Parámetros de filtro, página y orden de la vista de una campaña, para
+    conservarlos al redirigir"""
+    view_args = {
+        'query': source.get('query', ''),
+        'estatus_filter': source.get('estatus_filter', '')
+    }
+    for key in ('page', 'page_size', 'sort'):
+        if source.get(key):
+            view_args[key] = source.get(key)
+    return view_args
+
+def parse_positive_int(value, default):
+    """Convertir un parámetro a entero positivo, o usar el valor por defecto"""
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    return value if value > 0 else default
+
+@timed('sort')
+def sort_data(df, sort):
+    """Ordenar por una columna; el prefijo '-' indica orden descendente"""
+    column = sort.lstrip('-')
+    if column not in REQUIRED_COLUMNS:
+        return df
+    return df.sort_values(column, ascending=not sort.startswith('-'), kind='stable',
+                          key=lambda values: values.astype(str).str.lower())
+
+def paginate(df, page, page_size):
+    """Obtener una página del DataFrame, la página efectiva y el total de páginas"""
+    total_pages = max(1, -(-len(df) // page_size))
+    page = min(max(page, 1), total_pages)
+    start = (page - 1) * page_size
+    return df.iloc[start:start + page_size], page, total_pages
+
+class RecordError(Exception):
+    """Error al modificar un registro, con el mensaje para el usuario y el
+    código HTTP que corresponde"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+@timed('filter')
+def filter_records(data, query, estatus_filter):
+    """Registros de la campaña que cumplen la búsqueda y el filtro de estatus"""
+    df = data.search(query) if query else data.df
+    if estatus_filter:
+        df = df[df['Estatus'] == estatus_filter]
+    return df
+
+def update_campaign_record(campaign_name, cedula, values, version=None):
+    """Actualizar Estatus/Comentario de un registro y guardar el cambio.
+
+    version es la Version que tenía el registro cuando el usuario lo vio; si
+    desde entonces otra persona lo modificó, el cambio se rechaza con 409.
+    Cada edición guarda la versión siguiente.
+    """
+    if 'Estatus' in values and values['Estatus'] not in ESTATUS_OPTIONS:
+        raise RecordError(f'Error: Estatus no válido: {values["Estatus"]}')
+    values = dict(values, FechaActualizacion=datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    
+    with campaign_write_lock(campaign_name):
+        data = load_data(campaign_name)
+        
+        # Verificar que la cédula existe
+        if cedula not in data:
+            raise RecordError(f'Error: No se encontró registro con cédula {cedula}', 404)
+        
+        # Verificar que nadie lo modificó mientras tanto
+        current = max(record[VERSION_COLUMN] for record in data.get(cedula))
+        if version not in (None, '') and str(version) != str(current):
+            raise RecordError('Error: Otra persona modificó este registro. Recargue la página para ver los cambios.', 409)
+        
+        values[VERSION_COLUMN] = current + 1
+        data.update(cedula, values)
+        if not save_data(data, campaign_name, [{'op': 'update', 'cedula': cedula, 'values': values}]):
+            raise RecordError('Error al guardar los cambios', 500)
+        return data
+
+def add_campaign_record(campaign_name, fields):
+    """Validar y agregar un registro nuevo en estado Pendiente"""
+    nombre = str(fields.get('Nombre', '')).strip()
+    cedula = str(fields.get('Cedula', '')).strip()
+    telefono = str(fields.get('Telefono', '')).strip()
+    telefono2 = str(fields.get('Telefono2', '')).strip()
+    
+    # Validaciones
+    if not all([nombre, cedula, telefono]):
+        raise RecordError('Error: Nombre, cédula y teléfono principal son obligatorios')
+    
+    with campaign_write_lock(campaign_name):
+        data = load_data(campaign_name)
+        
+        # Verificar que la cédula no exista, aunque esté escrita de otra forma
+        existing = data.find_cedula(cedula)
+        if existing is not None:
+            raise RecordError(f'Error: Ya existe un registro con la cédula {existing}', 409)
+        
+        new_row = {
+            'Nombre': nombre,
+            'Cedula': cedula,
+            'Telefono': telefono,
+            'Telefono2': telefono2,
+            'Estatus': 'Pendiente',
+            'Comentario': '',
+            'FechaActualizacion': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        }
+        data.insert(new_row)
+        if not save_data(data, campaign_name, [{'op': 'insert', 'row': new_row}]):
+            raise RecordError('Error al guardar el nuevo registro', 500)
+        return new_row
+
+def delete_campaign_record(campaign_name, cedula):
+    """Eliminar los registros de una cédula y guardar el cambio"""
+    with campaign_write_lock(campaign_name):
+        data = load_data(campaign_name)
+        
+        if cedula not in data:
+            raise RecordError(f'Error: No se encontró registro con cédula {cedula}', 404)
+        
+        data.delete(cedula)
+        if not save_data(data, campaign_name, [{'op': 'delete', 'cedula': cedula}]):
+            raise RecordError('Error al eliminar el registro', 500)
+        return data
+
+def map_import_columns(header):
+    """Posición en el archivo de cada columna de la campaña según los encabezados"""
+    columns = {}
+    for position, name in enumerate(header):
+        key = re.sub(r'[^a-z0-9]', '', fold_text(cell_text(name)))
+        column = IMPORT_COLUMN_ALIASES.get(key)
+        if column and column not in columns:
+            columns[column] = position
+    return columns
+
+def detect_csv_encoding(file_path):
+    """UTF-8 si todo el archivo lo es; si no, Latin-1 (CSV guardados con Excel)"""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    try:
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                decoder.decode(chunk)
+            decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return 'latin-1'
+    return 'utf-8-sig'
+
+def iter_import_rows(file_path, extension, job):
+    """Leer las filas del archivo una a una sin cargarlo entero en memoria"""
+    if extension == '.xlsx':
+        from openpyxl import load_workbook
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheet = workbook.active
+            if sheet.max_row:
+                job['total_rows'] = sheet.max_row - 1
+            yield from sheet.iter_rows(values_only=True)
+        finally:
+            workbook.close()
+    else:
+        with open(file_path, 'r', encoding=detect_csv_encoding(file_path), newline='') as f:
+            sample = f.read(64 * 1024)
+            f.seek(0)
+            try:
+                dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+            except csv.Error:
+                dialect = csv.excel
+            yield from csv.reader(f, dialect)
+
+# Importaciones en curso o recientes, por id
+import_jobs = OrderedDict()
+import_jobs_lock = threading.Lock()
+
+def start_import_job(campaign_name, file_path, extension, file_name):
+    """Registrar una importación y procesarla en un hilo aparte"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'campaign': campaign_name,
+        'file_name': file_name,
+        'status': 'queued',
+        'rows_read': 0,
+        'total_rows': None,
+        'imported': 0,
+        'duplicates': 0,
+        'invalid': 0,
+        'errors': [],
+        'message': '',
+        'started': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'finished': None
+    }
+    with import_jobs_lock:
+        import_jobs[job['id']] = job
+        while len(import_jobs) > MAX_IMPORT_JOBS:
+            import_jobs.popitem(last=False)
+    threading.Thread(target=run_import_job, args=(job, file_path, extension), daemon=True).start()
+    return job
+
+def run_import_job(job, file_path, extension):
+    """Leer el archivo, validar y descartar duplicados, y agregar todo de una vez"""
+    campaign_name = job['campaign']
+    job['status'] = 'running'
+    try:
+        rows = iter_import_rows(file_path, extension, job)
+        header = next(rows, None)
+        if header is None:
+            raise RecordError('Error: El archivo está vacío')
+        columns = map_import_columns(header)
+        missing = [col for col in ('Nombre', 'Cedula', 'Telefono') if col not in columns]
+        if missing:
+            raise RecordError(f'Error: Faltan las columnas obligatorias: {", ".join(missing)}')
+        
+        data = load_data(campaign_name)
+        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        seen = set()
+        new_rows = []
+        for line_number, values in enumerate(rows, start=2):
+            record = {col: cell_text(values[pos]) if pos < len(values) else ''
+                      for col, pos in columns.items()}
+            if not any(record.values()):
+                continue
+            job['rows_read'] += 1
+            
+            problem = None
+            if not all(record.get(col) for col in ('Nombre', 'Cedula', 'Telefono')):
+                problem = 'faltan nombre, cédula o teléfono'
+            elif not normalize_phone(record['Telefono']) or (
+                    record.get('Telefono2') and not normalize_phone(record['Telefono2'])):
+                problem = 'teléfono no válido'
+            if problem:
+                job['invalid'] += 1
+                if len(job['errors']) < 20:
+                    job['errors'].append(f'Fila {line_number}: {problem}')
+                continue
+            
+            key = normalize_cedula(record['Cedula']) or cedula_key(record['Cedula'])
+            if key in seen or data.find_cedula(record['Cedula']) is not None:
+                job['duplicates'] += 1
+                continue
+            seen.add(key)
+            
+            estatus = record.get('Estatus')
+            new_rows.append((
+                record['Nombre'], record['Cedula'], record['Telefono'], record.get('Telefono2', ''),
+                estatus if estatus in ESTATUS_OPTIONS else 'Pendiente',
+                record.get('Comentario', ''), now
+            ))
+        
+        job['status'] = 'saving'
+        with campaign_write_lock(campaign_name):
+            data = load_data(campaign_name)
+            new_df = pd.DataFrame.from_records(new_rows, columns=REQUIRED_COLUMNS)
+            # Cédulas que alguien agregó mientras se leía el archivo
+            is_new = [data.find_cedula(cedula) is None for cedula in new_df['Cedula']]
+            job['duplicates'] += len(new_df) - sum(is_new)
+            new_df = new_df[is_new]
+            data.insert_many(new_df)
+            changes = [{'op': 'insert', 'row': row} for row in new_df.to_dict(orient='records')]
+            if changes and not save_data(data, campaign_name, changes):
+                raise RecordError('Error al guardar los registros importados')
+        job['imported'] = len(new_df)
+        job['status'] = 'done'
+        job['message'] = f'Se importaron {len(new_df)} registros'
+    except RecordError as e:
+        job['status'] = 'error'
+        job['message'] = str(e)
+    except Exception as e:
+        print(f"Error importando {job['file_name']} en {campaign_name}: {e}")
+        job['status'] = 'error'
+        job['message'] = 'Error inesperado al importar el archivo'
+    finally:
+        job['finished'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+dedupe_jobs = OrderedDict()
+dedupe_jobs_lock = threading.Lock()
+
+def start_dedupe_job(merge):
+    """Registrar una búsqueda de duplicados y hacerla en un hilo aparte"""
+    job = {
+        'id': uuid.uuid4().hex,
+        'status': 'queued',
+        'merge': merge,
+        'campaigns': 0,
+        'records': 0,
+        'groups': 0,
+        'cross_campaign': 0,
+        'merged': 0,
+        'duplicates': [],
+        'message': '',
+        'started': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'finished': None
+    }
+    with dedupe_jobs_lock:
+        dedupe_jobs[job['id']] = job
+        while len(dedupe_jobs) > MAX_DEDUPE_JOBS:
+            dedupe_jobs.popitem(last=False)
+    threading.Thread(target=run_dedupe_job, args=(job,), daemon=True).start()
+    return job
+
+def find_duplicates(campaign_names, limit=DEDUPE_REPORT_LIMIT):
+    """Registros con la misma cédula o el mismo teléfono normalizados, dentro
+    de una campaña o entre varias.
+
+    Las claves de todas las campañas se juntan en una sola tabla y se
+    agrupan por hash (groupby) en una pasada, sin comparar cada registro con
+    los demás. Devuelve los primeros limit grupos (los más grandes primero)
+    y los totales.
+    """
+    frames = []
+    snapshots = {}
+    for campaign_name in campaign_names:
+        data = load_data(campaign_name)
+        df, contact_keys = data.df, data.contact_keys
+        snapshots[campaign_name] = df
+        for kind, col in (('cedula', 'Cedula'), ('telefono', 'Telefono'), ('telefono', 'Telefono2')):
+            frames.append(pd.DataFrame({'campaign': campaign_name, 'label': contact_keys.index,
+                                        'kind': kind, 'key': contact_keys[col].to_numpy(dtype=object)}))
+    report = {'records': sum(len(df) for df in snapshots.values()), 'groups': 0, 'cross_campaign': 0, 'duplicates': []}
+    if not frames:
+        return report
+    keys = pd.concat(frames, ignore_index=True)
+    # Un registro con el mismo número en Telefono y Telefono2 no es un duplicado
+    keys = keys[keys['key'] != ''].drop_duplicates()
+    keys = keys[keys.duplicated(['kind', 'key'], keep=False)]
+    grouped = keys.groupby(['kind', 'key'], sort=False)
+    sizes = grouped.size().sort_values(ascending=False, kind='stable')
+    report['groups'] = len(sizes)
+    report['cross_campaign'] = int((grouped['campaign'].nunique() > 1).sum())
+    for kind, key in sizes.index[:limit]:
+        group = grouped.get_group((kind, key))
+        records = []
+        for campaign_name, label in zip(group['campaign'], group['label']):
+            df = snapshots[campaign_name]
+            if label in df.index:
+                records.append(dict({col: CampaignData._text_value(df.at[label, col]) for col in REQUIRED_COLUMNS},
+                                    campaign=campaign_name))
+        report['duplicates'].append({'kind': kind, 'key': key, 'records': records})
+    return report
+
+def merge_duplicates(campaign_name):
+    """Unir los registros de una campaña con la misma cédula normalizada:
+    queda el actualizado más recientemente, con el Telefono2 y Comentario de
+    los demás si no tenía. Devuelve cuántos registros se eliminaron."""
+    with campaign_write_lock(campaign_name):
+        data = load_data(campaign_name)
+        duplicates = data.normalized_duplicates()
+        removed = 0
+        for labels in duplicates.values():
+            rows = data.df.loc[labels]
+            fechas = date_values(rows['FechaActualizacion'])
+            keep = fechas.idxmax() if fechas.notna().any() else labels[0]
+            values = {}
+            for col in ('Telefono2', 'Comentario'):
+                if not rows.at[keep, col]:
+                    others = [value for value in rows[col] if value]
+                    if others:
+                        values[col] = others[0]
+            data.remove_rows([label for label in labels if label != keep])
+            if values:
+                values[VERSION_COLUMN] = int(rows.at[keep, VERSION_COLUMN]) + 1
+                data.update(rows.at[keep, 'Cedula'], values)
+            removed += len(labels) - 1
+        if removed and not save_data(data, campaign_name):
+            raise RecordError(f'Error al guardar la campaña {campaign_name}')
+        return removed
+
+def run_dedupe_job(job):
+    """Unir (si se pidió) los duplicados de cada campaña y buscar los que quedan"""
+    job['status'] = 'running'
+    try:
+        campaign_names = campaign_registry.names()
+        job['campaigns'] = len(campaign_names)
+        if job['merge']:
+            for campaign_name in campaign_names:
+                job['merged'] += merge_duplicates(campaign_name)
+        job.update(find_duplicates(campaign_names))
+        job['status'] = 'done'
+        job['message'] = f'Se encontraron {job["groups"]} grupos de duplicados'
+        if job['merge']:
+            job['message'] += f' y se unieron {job["merged"]} registros repetidos'
+    except RecordError as e:
+        job['status'] = 'error'
+        job['message'] = str(e)
+    except Exception as e:
+        print(f"Error buscando duplicados: {e}")
+        job['status'] = 'error'
+        job['message'] = 'Error inesperado al buscar duplicados'
+    finally:
+        job['finished'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def code_version():
+    """Última modificación de app.py y de las plantillas, para que las
+    respuestas que guardan los navegadores caduquen al actualizar la
+    aplicación"""
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    paths = [__file__] + [os.path.join(dirpath, file_name)
+                          for dirpath, _, file_names in os.walk(template_dir) for file_name in file_names]
+    return max(os.stat(path).st_mtime_ns for path in paths)
+
+CODE_VERSION = code_version()
+
+def data_version(campaign_names):
+    """Versión de los datos de varias campañas: su firma en el motor de
+    almacenamiento y, si tienen cambios diferidos sin guardar (que solo
+    conoce este proceso), el proceso y cuántos son"""
+    version = []
+    for campaign_name in campaign_names:
+        pending = write_behind.pending_count(campaign_name)
+        version.append([campaign_name, storage.signature(campaign_name), [os.getpid(), pending] if pending else None])
+    return version
+
+def data_last_modified(campaign_names):
+    """Fecha de la última escritura de las campañas, de la lista de campañas
+    (el menú de todas las páginas) o de la aplicación; None si no se sabe
+    la de alguna campaña. Last-Modified solo tiene segundos: si algo cambió
+    en este mismo segundo se devuelve None, porque otro cambio en ese
+    segundo tendría la misma fecha."""
+    mtimes = [CODE_VERSION / 1e9]
+    campaigns_file = get_campaigns_list_path()
+    if os.path.exists(campaigns_file):
+        mtimes.append(os.path.getmtime(campaigns_file))
+    for campaign_name in campaign_names:
+        modified = storage.last_modified(campaign_name)
+        if modified is None:
+            return None
+        mtimes.append(modified)
+    latest = int(max(mtimes))
+    if latest >= int(time.time()):
+        return None
+    return datetime.fromtimestamp(latest, timezone.utc)
+
+def conditional(view):
+    """Respuestas condicionales (ETag/Last-Modified) para una vista GET que
+    solo depende de la URL y de los datos de la campaña indicada (o de todas).
+
+    Si el navegador ya tiene la versión actual se responde 304 sin cargar
+    ni renderizar nada. No se aplica si hay mensajes flash pendientes, que
+    se mostrarían en la página.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        campaign_name = kwargs.get('campaign_name')
+        if '_flashes' in session or (campaign_name is not None and campaign_name not in campaign_registry):
+            return view(*args, **kwargs)
+        campaigns = campaign_registry.names()
+        campaign_names = [campaign_name] if campaign_name is not None else campaigns
+        version = data_version(campaign_names)
+        etag = hashlib.sha1(json.dumps([CODE_VERSION, request.full_path, campaigns, version],
+                                       ensure_ascii=False, default=str).encode()).hexdigest()
+        # Con cambios diferidos la fecha del archivo no dice nada: solo ETag
+        last_modified = None if any(entry[2] for entry in version) else data_last_modified(campaign_names)
+        if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+            response = Response(status=304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+        # Débil: la misma versión se envía comprimida o no según el navegador
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+        return response
+    return wrapper
+
+@app.before_request
+def start_request_timer():
+    """Medir la petición y, si se pidió y está permitido, perfilarla"""
+    g.request_start = time.perf_counter()
+    if PROFILING and request.args.get('_profile') == '1':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request_metrics(response):
+    """Anotar la duración de la petición (en las descargas, hasta que
+    empieza el envío) y devolver el informe de perfilado si lo hay"""
+    endpoint = request.endpoint or 'none'
+    metrics.observe('xoocrm_request_seconds', time.perf_counter() - g.request_start,
+                    endpoint=endpoint, method=request.method)
+    metrics.inc('xoocrm_requests_total', endpoint=endpoint, method=request.method,
+                status=str(response.status_code))
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        return Response(report.getvalue(), mimetype='text/plain')
+    return response
+
+@app.after_request
+def compress_response(response):
+    """Comprimir las páginas y respuestas JSON grandes con brotli o gzip"""
+    if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESS_MIMETYPES):
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_BYTES:
+        return response
+    if brotli is not None and request.accept_encodings['br']:
+        response.set_data(brotli.compress(body, quality=BROTLI_QUALITY))
+        response.headers['Content-Encoding'] = 'br'
+    elif request.accept_encodings['gzip']:
+        response.set_data(gzip.compress(body, GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+@before_render_template.connect_via(app)
+def start_template_timer(sender, template, context, **extra):
+    g.template_start = time.perf_counter()
+
+@template_rendered.connect_via(app)
+def record_template_time(sender, template, context, **extra):
+    metrics.observe('xoocrm_template_render_seconds', time.perf_counter() - g.pop('template_start'),
+                    template=template.name)
+
+@app.route('/metrics')
+def metrics_view():
+    """Métricas del proceso en formato Prometheus"""
+    cache = campaign_cache.stats()
+    lookups = cache['hits'] + cache['misses']
+    summary = load_stats_summary()
+    rows = [({'campaign': name}, summary[name]['stats']['total'])
+            for name in campaign_registry.names() if name in summary]
+    with write_behind.lock:
+        pending = [({'campaign': name}, len(changes)) for name, changes in write_behind.pending.items()]
+    values = {
+        'xoocrm_cache_hits_total': [({}, cache['hits'])],
+        'xoocrm_cache_misses_total': [({}, cache['misses'])],
+        'xoocrm_cache_evictions_total': [({}, cache['evictions'])],
+        'xoocrm_cache_hit_ratio': [({}, cache['hits'] / lookups if lookups else 0)],
+        'xoocrm_cache_bytes': [({}, cache['bytes'])],
+        'xoocrm_cache_entries': [({}, cache['entries'])],
+        'xoocrm_campaign_rows': rows,
+        'xoocrm_write_behind_pending': pending,
+    }
+    return Response(metrics.render(values), mimetype='text/plain; version=0.0.4')
+
 @app.route('/')
 def select_campaign():
     """Página principal para seleccionar campaña"""
     campaigns = load_campaigns_list()
-    return render_template('select_campaign.html', campaigns=campaigns)
+    return render_template('select_campaign.html', campaigns=campaigns, orphans=campaign_registry.orphans)
+
+@app.route('/api/stats')
+@conditional
+def campaigns_stats():
+    """Estadísticas de todas las campañas en formato JSON"""
+    stats = {}
+    for campaign in load_campaigns_list():
+        stats[campaign] = get_campaign_stats(campaign)
+    return jsonify(stats)
+
+@app.route('/api/search')
+@conditional
+def api_global_search():
+    """Buscar un contacto por cédula, teléfono o nombre en todas las campañas"""
+    query = request.args.get('q', '').strip()
+    search_index.refresh()
+    start = time.perf_counter()
+    results, total = search_index.search(query)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    for result in results:
+        result['url'] = url_for('campaign_index', campaign_name=result['campaign'], query=result['Cedula'])
+    return jsonify({'query': query, 'results': results, 'total': total, 'elapsed_ms': round(elapsed_ms, 3)})
+
+@app.route('/api/campaigns')
+def api_list_campaigns():
+    """Campañas con sus metadatos y los archivos .xlsx que no son de ninguna"""
+    campaign_registry.reconcile()
+    return jsonify({
+        'campaigns': [campaign_registry.metadata(name) for name in campaign_registry.names()],
+        'orphans': campaign_registry.orphans
+    })
 
 @app.route('/campaign/<campaign_name>')
+@conditional
 def campaign_index(campaign_name):
     """Página principal de una campaña específica"""
-    if campaign_name not in load_campaigns_list():
+    if campaign_name not in campaign_registry:
         flash(f'La campaña "{campaign_name}" no existe', 'error')
         return redirect(url_for('select_campaign'))
     
     query = request.args.get('query', '').strip()
     estatus_filter = request.args.get('estatus_filter', '')
+    sort = request.args.get('sort', '')
+    page = parse_positive_int(request.args.get('page'), 1)
+    page_size = parse_positive_int(request.args.get('page_size'), DEFAULT_PAGE_SIZE)
+    if page_size not in PAGE_SIZE_OPTIONS:
+        page_size = DEFAULT_PAGE_SIZE
     
-    df = load_data(campaign_name)
-    filtered_df = df.copy()
+    data = load_data(campaign_name)
 
     # Aplicar filtros
-    if query:
-        filtered_df = df[df.apply(lambda row:
-            query.lower() in str(row['Nombre']).lower() or
-            query.lower() in str(row['Cedula']).lower() or
-            query.lower() in str(row['Telefono']).lower() or
-            query.lower() in str(row['Telefono2']).lower() or
-            query.lower() in str(row['Comentario']).lower(), axis=1)]
-    
-    if estatus_filter and estatus_filter != '':
-        filtered_df = filtered_df[filtered_df['Estatus'] == estatus_filter]
-
-    # Calcular estadísticas
-    stats = {
-        'total': len(df),
-        'pendientes': len(df[df['Estatus'] == 'Pendiente']),
-        'llamados': len(df[df['Estatus'] == 'Llamado']),
-        'elegibles': len(df[df['Estatus'] == 'Elegible']),
-        'no_elegibles': len(df[df['Estatus'] == 'No Elegible']),
-        'NoTieneWhatsapp': len(df[df['Estatus'] == 'No Tiene Whatsapp'])
-    }
+    filtered_df = filter_records(data, query, estatus_filter)
+
+    # Ordenar y quedarse solo con la página pedida antes de convertir a diccionarios
+    if sort:
+        filtered_df = sort_data(filtered_df, sort)
+    page_df, page, total_pages = paginate(filtered_df, page, page_size)
+
+    # Estadísticas mantenidas al día en memoria
+    stats = data.stats()
 
     return render_template('campaign_index.html', 
-                         data=filtered_df.to_dict(orient='records'), 
+                         data=records_to_dicts(page_df), 
                          query=query,
                          estatus_filter=estatus_filter,
+                         sort=sort,
+                         page=page,
+                         page_size=page_size,
+                         page_size_options=PAGE_SIZE_OPTIONS,
+                         total_pages=total_pages,
+                         total_filtered=len(filtered_df),
                          stats=stats,
                          campaign_name=campaign_name,
+                         duplicates=sorted(data.duplicates()),
                          campaigns=load_campaigns_list())
 
 @app.route('/campaign/<campaign_name>/edit', methods=['POST'])
 def edit_record(campaign_name):
     """Editar un registro de una campaña específica"""
-    if campaign_name not in load_campaigns_list():
+    if campaign_name not in campaign_registry:
         flash(f'La campaña "{campaign_name}" no existe', 'error')
         return redirect(url_for('select_campaign'))
     
@@ -147,84 +2964,39 @@ def edit_record(campaign_name):
         comentario = request.form['Comentario'].strip()
         
         # Capturar los parámetros de filtro para redirigir
-        query = request.form.get('query', '')
-        estatus_filter = request.form.get('estatus_filter', '')
+        view_args = get_view_args(request.form)
 
         if not cedula:
             flash('Error: Cédula no puede estar vacía', 'error')
-            return redirect(url_for('campaign_index', campaign_name=campaign_name, query=query, estatus_filter=estatus_filter))
+            return redirect(url_for('campaign_index', campaign_name=campaign_name, **view_args))
 
-        df = load_data(campaign_name)
-        
-        # Verificar que la cédula existe
-        if cedula not in df['Cedula'].values:
-            flash(f'Error: No se encontró registro con cédula {cedula}', 'error')
-            return redirect(url_for('campaign_index', campaign_name=campaign_name, query=query, estatus_filter=estatus_filter))
-
-        # Actualizar datos
-        mask = df['Cedula'] == cedula
-        df.loc[mask, 'Estatus'] = estatus
-        df.loc[mask, 'Comentario'] = comentario
-        df.loc[mask, 'FechaActualizacion'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        
-        if save_data(df, campaign_name):
-            flash(f'Registro actualizado exitosamente', 'success')
-        else:
-            flash('Error al guardar los cambios', 'error')
+        update_campaign_record(campaign_name, cedula, {'Estatus': estatus, 'Comentario': comentario},
+                               version=request.form.get('version'))
+        flash(f'Registro actualizado exitosamente', 'success')
 
+    except RecordError as e:
+        flash(str(e), 'error')
     except Exception as e:
         print(f"Error en edit: {e}")
         flash('Error inesperado al actualizar el registro', 'error')
-        query = request.form.get('query', '')
-        estatus_filter = request.form.get('estatus_filter', '')
+        view_args = get_view_args(request.form)
 
-    return redirect(url_for('campaign_index', campaign_name=campaign_name, query=query, estatus_filter=estatus_filter))
+    return redirect(url_for('campaign_index', campaign_name=campaign_name, **view_args))
 
 @app.route('/campaign/<campaign_name>/add', methods=['GET', 'POST'])
 def add_record(campaign_name):
     """Agregar un registro a una campaña específica"""
-    if campaign_name not in load_campaigns_list():
+    if campaign_name not in campaign_registry:
         flash(f'La campaña "{campaign_name}" no existe', 'error')
         return redirect(url_for('select_campaign'))
     
     if request.method == 'POST':
         try:
-            nombre = request.form['Nombre'].strip()
-            cedula = request.form['Cedula'].strip()
-            telefono = request.form['Telefono'].strip()
-            telefono2 = request.form['Telefono2'].strip()
-            
-            # Validaciones
-            if not all([nombre, cedula, telefono]):
-                flash('Error: Nombre, cédula y teléfono principal son obligatorios', 'error')
-                return render_template('add_record.html', campaign_name=campaign_name, campaigns=load_campaigns_list())
-            
-            df = load_data(campaign_name)
-            
-            # Verificar que la cédula no exista
-            if cedula in df['Cedula'].values:
-                flash(f'Error: Ya existe un registro con la cédula {cedula}', 'error')
-                return render_template('add_record.html', campaign_name=campaign_name, campaigns=load_campaigns_list())
-            
-            # Agregar nuevo registro
-            new_row = {
-                'Nombre': nombre,
-                'Cedula': cedula,
-                'Telefono': telefono,
-                'Telefono2': telefono2,
-                'Estatus': 'Pendiente',
-                'Comentario': '',
-                'FechaActualizacion': datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            }
-            
-            df = pd.concat([df, pd.DataFrame([new_row])], ignore_index=True)
-            
-            if save_data(df, campaign_name):
-                flash(f'Registro agregado exitosamente: {nombre}', 'success')
-                return redirect(url_for('campaign_index', campaign_name=campaign_name))
-            else:
-                flash('Error al guardar el nuevo registro', 'error')
-                
+            new_row = add_campaign_record(campaign_name, request.form)
+            flash(f'Registro agregado exitosamente: {new_row["Nombre"]}', 'success')
+            return redirect(url_for('campaign_index', campaign_name=campaign_name))
+        except RecordError as e:
+            flash(str(e), 'error')
         except Exception as e:
             print(f"Error en add: {e}")
             flash('Error inesperado al agregar el registro', 'error')
@@ -234,36 +3006,326 @@ def add_record(campaign_name):
 @app.route('/campaign/<campaign_name>/delete/<cedula>', methods=['POST'])
 def delete_record(campaign_name, cedula):
     """Eliminar un registro de una campaña específica"""
-    if campaign_name not in load_campaigns_list():
+    if campaign_name not in campaign_registry:
         flash(f'La campaña "{campaign_name}" no existe', 'error')
         return redirect(url_for('select_campaign'))
     
     try:
         # Capturar los parámetros de filtro para redirigir
-        query = request.form.get('query', '')
-        estatus_filter = request.form.get('estatus_filter', '')
-        
-        df = load_data(campaign_name)
-        
-        if cedula not in df['Cedula'].values:
-            flash(f'Error: No se encontró registro con cédula {cedula}', 'error')
-            return redirect(url_for('campaign_index', campaign_name=campaign_name, query=query, estatus_filter=estatus_filter))
-        
-        # Eliminar registro
-        df = df[df['Cedula'] != cedula]
+        view_args = get_view_args(request.form)
         
-        if save_data(df, campaign_name):
-            flash(f'Registro eliminado exitosamente', 'success')
-        else:
-            flash('Error al eliminar el registro', 'error')
+        delete_campaign_record(campaign_name, cedula)
+        flash(f'Registro eliminado exitosamente', 'success')
             
+    except RecordError as e:
+        flash(str(e), 'error')
     except Exception as e:
         print(f"Error en delete: {e}")
         flash('Error inesperado al eliminar el registro', 'error')
-        query = request.form.get('query', '')
-        estatus_filter = request.form.get('estatus_filter', '')
+        view_args = get_view_args(request.form)
     
-    return redirect(url_for('campaign_index', campaign_name=campaign_name, query=query, estatus_filter=estatus_filter))
+    return redirect(url_for('campaign_index', campaign_name=campaign_name, **view_args))
+
+def api_error(message, status):
+    """Respuesta JSON de error de la API"""
+    return jsonify({'error': message}), status
+
+@app.route('/api/campaign/<campaign_name>/records', methods=['GET'])
+@conditional
+def api_list_records(campaign_name):
+    """Listar registros con los mismos filtros, orden y paginación de la tabla"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    query = request.args.get('query', '').strip()
+    estatus_filter = request.args.get('estatus_filter', '')
+    sort = request.args.get('sort', '')
+    page = parse_positive_int(request.args.get('page'), 1)
+    page_size = min(parse_positive_int(request.args.get('page_size'), DEFAULT_PAGE_SIZE),
+                    max(PAGE_SIZE_OPTIONS))
+    
+    data = load_data(campaign_name)
+    filtered_df = filter_records(data, query, estatus_filter)
+    if sort:
+        filtered_df = sort_data(filtered_df, sort)
+    page_df, page, total_pages = paginate(filtered_df, page, page_size)
+    
+    return jsonify({
+        'records': records_to_dicts(page_df),
+        'page': page,
+        'page_size': page_size,
+        'total_pages': total_pages,
+        'total': len(filtered_df),
+        'stats': data.stats()
+    })
+
+@app.route('/api/campaign/<campaign_name>/records', methods=['POST'])
+def api_create_record(campaign_name):
+    """Crear un registro a partir de un JSON con Nombre, Cedula, Telefono y Telefono2"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    try:
+        new_row = add_campaign_record(campaign_name, request.get_json(silent=True) or {})
+        return jsonify({'record': new_row, 'stats': load_data(campaign_name).stats()}), 201
+    except RecordError as e:
+        return api_error(str(e), e.status)
+    except Exception as e:
+        print(f"Error en api add: {e}")
+        return api_error('Error inesperado al agregar el registro', 500)
+
+@app.route('/api/campaign/<campaign_name>/records/<cedula>', methods=['GET'])
+@conditional
+def api_get_record(campaign_name, cedula):
+    """Obtener un registro por cédula"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    records = load_data(campaign_name).get(cedula)
+    if not records:
+        return api_error(f'Error: No se encontró registro con cédula {cedula}', 404)
+    return jsonify({'record': records[0]})
+
+@app.route('/api/campaign/<campaign_name>/records/<cedula>', methods=['PATCH'])
+def api_update_record(campaign_name, cedula):
+    """Modificar Estatus y/o Comentario de un registro"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    try:
+        body = request.get_json(silent=True) or {}
+        values = {}
+        if 'Estatus' in body:
+            values['Estatus'] = str(body['Estatus'])
+        if 'Comentario' in body:
+            values['Comentario'] = str(body['Comentario']).strip()
+        if not values:
+            return api_error('Error: Indique Estatus o Comentario', 400)
+        
+        data = update_campaign_record(campaign_name, cedula, values, version=body.get('version'))
+        return jsonify({'record': data.get(cedula)[0], 'stats': data.stats()})
+    except RecordError as e:
+        return api_error(str(e), e.status)
+    except Exception as e:
+        print(f"Error en api edit: {e}")
+        return api_error('Error inesperado al actualizar el registro', 500)
+
+@app.route('/api/campaign/<campaign_name>/next', methods=['POST'])
+def api_next_record(campaign_name):
+    """Asignar al agente el siguiente contacto pendiente de la campaña"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    body = request.get_json(silent=True) or {}
+    agent = str(body.get('agent', '')).strip()
+    if not agent:
+        return api_error('Error: Indique el nombre del agente', 400)
+    
+    try:
+        record, lease = dispatcher.next(campaign_name, agent)
+        return jsonify({
+            'record': record,
+            'lease': lease,
+            'remaining': dispatcher.remaining(campaign_name, load_data(campaign_name))
+        })
+    except Exception as e:
+        print(f"Error asignando contacto: {e}")
+        return api_error('Error inesperado al asignar el contacto', 500)
+
+@app.route('/api/campaign/<campaign_name>/next/<cedula>/release', methods=['POST'])
+def api_release_record(campaign_name, cedula):
+    """Soltar la reserva de un contacto sin cambiar su estatus"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    body = request.get_json(silent=True) or {}
+    agent = str(body.get('agent', '')).strip()
+    if not agent:
+        return api_error('Error: Indique el nombre del agente', 400)
+    if not dispatcher.release(campaign_name, cedula, agent):
+        return api_error('Error: El contacto no está reservado por este agente', 404)
+    return jsonify({'released': cedula})
+
+@app.route('/api/campaign/<campaign_name>/leases')
+def api_list_leases(campaign_name):
+    """Contactos reservados ahora mismo y por quién"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    return jsonify({'leases': dispatcher.leases(campaign_name)})
+
+@app.route('/campaign/<campaign_name>/dispatch')
+def dispatch_view(campaign_name):
+    """Pantalla del agente: un contacto pendiente a la vez"""
+    if campaign_name not in campaign_registry:
+        flash(f'La campaña "{campaign_name}" no existe', 'error')
+        return redirect(url_for('select_campaign'))
+    return render_template('dispatch.html',
+                         campaign_name=campaign_name,
+                         estatus_options=ESTATUS_OPTIONS,
+                         lease_minutes=LEASE_SECONDS // 60,
+                         campaigns=load_campaigns_list())
+
+@app.route('/api/campaign/<campaign_name>/records/<cedula>', methods=['DELETE'])
+def api_delete_record(campaign_name, cedula):
+    """Eliminar un registro por cédula"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    try:
+        data = delete_campaign_record(campaign_name, cedula)
+        return jsonify({'deleted': cedula, 'stats': data.stats()})
+    except RecordError as e:
+        return api_error(str(e), e.status)
+    except Exception as e:
+        print(f"Error en api delete: {e}")
+        return api_error('Error inesperado al eliminar el registro', 500)
+
+@app.route('/api/campaign/<campaign_name>/records/<cedula>/history')
+@conditional
+def api_record_history(campaign_name, cedula):
+    """Historial de cambios de un registro, del más antiguo al más reciente"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    history = record_history(campaign_name, cedula)
+    if not history:
+        return api_error(f'Error: No hay historial para la cédula {cedula}', 404)
+    return jsonify({'cedula': cedula, 'events': history})
+
+@app.route('/api/campaign/<campaign_name>/rebuild', methods=['POST'])
+def api_rebuild_campaign(campaign_name):
+    """Reconstruir los registros de una campaña desde su historial y
+    reescribir el archivo (por ejemplo si el Excel se dañó)"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    try:
+        with campaign_write_lock(campaign_name):
+            replayed = replay_audit_log(campaign_name)
+            if replayed is None:
+                return api_error('Error: La campaña no tiene historial', 404)
+            data, events = replayed
+            if not save_data(data, campaign_name):
+                return api_error('Error al guardar la campaña reconstruida', 500)
+        return jsonify({'records': len(data), 'events': events, 'stats': data.stats()})
+    except Exception as e:
+        print(f"Error reconstruyendo {campaign_name}: {e}")
+        return api_error('Error inesperado al reconstruir la campaña', 500)
+
+@app.route('/api/campaign/<campaign_name>/import', methods=['POST'])
+def api_import_records(campaign_name):
+    """Subir un archivo CSV/XLSX de contactos e importarlo en segundo plano"""
+    if campaign_name not in campaign_registry:
+        return api_error(f'La campaña "{campaign_name}" no existe', 404)
+    
+    upload = request.files.get('file')
+    if upload is None or not upload.filename:
+        return api_error('Error: Seleccione un archivo CSV o XLSX', 400)
+    extension = os.path.splitext(upload.filename)[1].lower()
+    if extension not in IMPORT_EXTENSIONS:
+        return api_error('Error: Solo se pueden importar archivos CSV o XLSX', 400)
+    
+    try:
+        # Guardar la subida en disco por partes y procesarla desde ahí
+        fd, file_path = tempfile.mkstemp(suffix=extension)
+        os.close(fd)
+        upload.save(file_path)
+        job = start_import_job(campaign_name, file_path, extension, upload.filename)
+        return jsonify(job), 202
+    except Exception as e:
+        print(f"Error recibiendo importación: {e}")
+        return api_error('Error inesperado al recibir el archivo', 500)
+
+@app.route('/api/import/<job_id>')
+def api_import_status(job_id):
+    """Progreso de una importación"""
+    with import_jobs_lock:
+        job = import_jobs.get(job_id)
+    if job is None:
+        return api_error('Error: No se encontró la importación', 404)
+    return jsonify(job)
+
+@app.route('/api/dedupe', methods=['POST'])
+def api_start_dedupe():
+    """Buscar duplicados en todas las campañas en segundo plano; con
+    merge=1 también se unen los repetidos dentro de cada campaña"""
+    options = request.get_json(silent=True) or request.form
+    merge = str(options.get('merge', '')).lower() in ('1', 'true', 'on')
+    job = start_dedupe_job(merge)
+    return jsonify(job), 202
+
+@app.route('/api/dedupe/<job_id>')
+def api_dedupe_status(job_id):
+    """Progreso y resultado de una búsqueda de duplicados"""
+    with dedupe_jobs_lock:
+        job = dedupe_jobs.get(job_id)
+    if job is None:
+        return api_error('Error: No se encontró la búsqueda de duplicados', 404)
+    return jsonify(job)
+
+def iter_export_chunks(df):
+    """Recorrer un DataFrame por bloques de filas"""
+    for start in range(0, len(df), EXPORT_CHUNK_ROWS):
+        yield df.iloc[start:start + EXPORT_CHUNK_ROWS]
+
+def generate_csv_export(df):
+    """CSV por partes; el BOM hace que Excel reconozca los acentos"""
+    yield '\ufeff' + ','.join(REQUIRED_COLUMNS) + '\r\n'
+    for chunk in iter_export_chunks(df):
+        yield to_text_frame(chunk).to_csv(index=False, header=False, lineterminator='\r\n')
+
+def generate_xlsx_export(df, sheet_title):
+    """XLSX en modo de solo escritura (las filas van a disco, no a memoria) y
+    enviado por partes desde un archivo temporal"""
+    from openpyxl import Workbook
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet(title=sheet_title)
+    sheet.append(REQUIRED_COLUMNS)
+    for chunk in iter_export_chunks(df):
+        for row in to_text_frame(chunk).itertuples(index=False, name=None):
+            sheet.append(row)
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        yield from iter(lambda: f.read(EXPORT_CHUNK_BYTES), b'')
+
+@app.route('/campaign/<campaign_name>/export')
+def export_records(campaign_name):
+    """Descargar los registros que se ven con la búsqueda y el filtro actuales"""
+    if campaign_name not in campaign_registry:
+        flash(f'La campaña "{campaign_name}" no existe', 'error')
+        return redirect(url_for('select_campaign'))
+    
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_FORMATS:
+        flash('Error: Formato de exportación no válido', 'error')
+        return redirect(url_for('campaign_index', campaign_name=campaign_name, **get_view_args(request.args)))
+    
+    query = request.args.get('query', '').strip()
+    estatus_filter = request.args.get('estatus_filter', '')
+    sort = request.args.get('sort', '')
+    
+    with get_campaign_lock(campaign_name):
+        data = load_data(campaign_name)
+        # Copia superficial: las ediciones posteriores no alteran la descarga en curso
+        df = filter_records(data, query, estatus_filter)[REQUIRED_COLUMNS].copy(deep=False)
+    if sort:
+        df = sort_data(df, sort)
+    
+    file_name = f'{campaign_name} - {estatus_filter or "Todos"}.{export_format}'
+    ascii_name = file_name.encode('ascii', 'ignore').decode().replace('"', '') or f'export.{export_format}'
+    headers = {
+        'Content-Disposition': f'attachment; filename="{ascii_name}"; filename*=UTF-8\'\'{quote(file_name)}',
+        'X-Total-Records': str(len(df))
+    }
+    if export_format == 'csv':
+        return Response(stream_with_context(generate_csv_export(df)),
+                        mimetype='text/csv; charset=utf-8', headers=headers)
+    # Excel no admite algunos caracteres ni más de 31 en el nombre de la hoja
+    sheet_title = re.sub(r'[\\/*?:\[\]]', '', campaign_name)[:31] or 'Registros'
+    return Response(stream_with_context(generate_xlsx_export(df, sheet_title)),
+                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+                    headers=headers)
 
 @app.route('/add_campaign', methods=['POST'])
 def add_campaign():
@@ -275,19 +3337,15 @@ def add_campaign():
             flash('Error: El nombre de la campaña no puede estar vacío', 'error')
             return redirect(url_for('select_campaign'))
         
-        campaigns = load_campaigns_list()
-        
-        if campaign_name in campaigns:
-            flash(f'Error: Ya existe una campaña con el nombre "{campaign_name}"', 'error')
-            return redirect(url_for('select_campaign'))
-        
-        # Agregar nueva campaña
-        campaigns.append(campaign_name)
-        save_campaigns_list(campaigns)
+        with campaigns_list_lock():
+            # Agregar nueva campaña
+            if not campaign_registry.add(campaign_name):
+                flash(f'Error: Ya existe una campaña con el nombre "{campaign_name}"', 'error')
+                return redirect(url_for('select_campaign'))
         
         # Crear el archivo Excel vacío para la nueva campaña
-        df = pd.DataFrame(columns=["Nombre", "Cedula", "Telefono", "Telefono2", "Estatus", "Comentario", "FechaActualizacion"])
-        save_data(df, campaign_name)
+        with campaign_write_lock(campaign_name):
+            save_data(CampaignData.empty(), campaign_name)
         
         flash(f'Campaña "{campaign_name}" creada exitosamente', 'success')
         return redirect(url_for('campaign_index', campaign_name=campaign_name))
@@ -301,24 +3359,27 @@ def add_campaign():
 def delete_campaign(campaign_name):
     """Eliminar una campaña completa"""
     try:
-        campaigns = load_campaigns_list()
-        
-        if campaign_name not in campaigns:
-            flash(f'Error: La campaña "{campaign_name}" no existe', 'error')
-            return redirect(url_for('select_campaign'))
-        
-        if len(campaigns) <= 1:
-            flash('Error: No puedes eliminar la última campaña', 'error')
-            return redirect(url_for('select_campaign'))
-        
-        # Eliminar de la lista
-        campaigns.remove(campaign_name)
-        save_campaigns_list(campaigns)
+        with campaigns_list_lock():
+            if campaign_name not in campaign_registry:
+                flash(f'Error: La campaña "{campaign_name}" no existe', 'error')
+                return redirect(url_for('select_campaign'))
+            
+            if len(campaign_registry) <= 1:
+                flash('Error: No puedes eliminar la última campaña', 'error')
+                return redirect(url_for('select_campaign'))
+            
+            # Eliminar de la lista
+            campaign_registry.remove(campaign_name)
         
-        # Eliminar el archivo
-        file_path = get_campaign_file_path(campaign_name)
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        # Eliminar los registros
+        with campaign_write_lock(campaign_name):
+            write_behind.forget(campaign_name)
+            storage.delete_campaign(campaign_name)
+            campaign_cache.invalidate(campaign_name)
+            forget_stats_summary(campaign_name)
+            search_index.invalidate(campaign_name)
+            dispatcher.forget(campaign_name)
+            forget_audit_log(campaign_name)
         
         flash(f'Campaña "{campaign_name}" eliminada exitosamente', 'success')
         return redirect(url_for('select_campaign'))
@@ -328,5 +3389,39 @@ def delete_campaign(campaign_name):
         flash('Error inesperado al eliminar la campaña', 'error')
         return redirect(url_for('select_campaign'))
 
+def configure_app(config=None):
+    """Configurar la aplicación del módulo y devolverla (ver wsgi.py). Se
+    llama una sola vez por proceso, antes de atender peticiones.
+
+    No es una fábrica de aplicaciones: las rutas y todo el estado (caché,
+    índice de búsqueda, reparto, escritura diferida, candados, lo que se
+    guarda al salir) son del módulo, así que hay una sola aplicación por
+    proceso. config acepta opciones de Flask (por ejemplo SECRET_KEY) y
+    CAMPAIGNS_DIR; con otra carpeta, ese estado se vuelve a crear vacío
+    para ella. Una segunda llamada lanza RuntimeError.
+    """
+    global CAMPAIGNS_DIR, storage, campaign_registry, campaign_cache, search_index, dispatcher, state_db, audit_db
+    if app.config.get('CRM_CONFIGURED'):
+        raise RuntimeError('Error: La aplicación ya se configuró en este proceso')
+    app.config['CRM_CONFIGURED'] = True
+    config = dict(config or {})
+    campaigns_dir = config.pop('CAMPAIGNS_DIR', CAMPAIGNS_DIR)
+    app.config.update(config)
+    if campaigns_dir != CAMPAIGNS_DIR:
+        write_behind.flush()
+        CAMPAIGNS_DIR = campaigns_dir
+        storage = create_storage(STORAGE_BACKEND)
+        campaign_registry = CampaignRegistry()
+        campaign_cache = CampaignCache(campaign_cache.max_bytes)
+        search_index = SearchIndex()
+        dispatcher = Dispatcher(LEASE_SECONDS)
+        state_db = StateDatabase(os.path.join(CAMPAIGNS_DIR, STATE_DB_FILE))
+        audit_db = AuditDatabase(os.path.join(CAMPAIGNS_DIR, AUDIT_DB_FILE))
+    app.config['CAMPAIGNS_DIR'] = CAMPAIGNS_DIR
+    if WRITE_BEHIND:
+        # Guardar los diarios de una ejecución anterior que terminó de golpe
+        write_behind.start()
+    return app
+
 if __name__ == '__main__':
-    app.run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
+    configure_app().run(debug=True, host='127.0.0.1', port=5000)
\ No newline at end of file
@@ -0,0 +1,219 @@
+"""Benchmark del CRM con campañas sintéticas.
+
+Genera campañas de prueba (nombres, cédulas y teléfonos dominicanos) en una
+carpeta temporal, recorre las páginas y acciones principales con el cliente
+de pruebas de Flask y escribe en JSON los percentiles de latencia y el pico
+de memoria de cada escenario, para comparar versiones.
+
+Uso:
+    python benchmark.py --sizes 1000,10000,100000 --repeat 20 --output resultado.json
+
+El motor de almacenamiento y demás opciones se toman de las mismas variables
+de entorno que app.py (CRM_STORAGE_BACKEND, CRM_WRITE_BEHIND, ...).
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Windows: no hay getrusage, no se informa la memoria máxima del proceso
+    resource = None
+
+NOMBRES = [
+    'Juan', 'José', 'Luis', 'Carlos', 'Miguel', 'Rafael', 'Pedro', 'Francisco', 'Ramón', 'Manuel',
+    'Starlin', 'Wilkin', 'Franklin', 'Yeison', 'Darlin', 'Anderson', 'Junior', 'Héctor', 'Julio', 'Félix',
+    'Ana', 'María', 'Rosa', 'Carmen', 'Altagracia', 'Mercedes', 'Juana', 'Francisca', 'Yokasta', 'Yajaira',
+    'Wendy', 'Esmeralda', 'Yamilet', 'Yudelka', 'Massiel', 'Dahiana', 'Leidy', 'Katherine', 'Miguelina', 'Ángela',
+]
+APELLIDOS = [
+    'Rodríguez', 'Pérez', 'Martínez', 'García', 'Reyes', 'Sánchez', 'Díaz', 'Jiménez', 'Peña', 'Santana',
+    'Ramírez', 'Núñez', 'Féliz', 'Castillo', 'Cruz', 'Rosario', 'Mejía', 'Batista', 'De la Cruz', 'Polanco',
+    'Almonte', 'Vásquez', 'Guzmán', 'Tavárez', 'Báez', 'Encarnación', 'Mateo', 'De los Santos', 'Paulino', 'Ureña',
+]
+COMENTARIOS = ['', '', '', '', 'Llamar en la tarde', 'No contesta', 'Interesado', 'Enviar información por WhatsApp']
+ESTATUS_PESOS = {'Pendiente': 0.5, 'Llamado': 0.2, 'Elegible': 0.1, 'No Elegible': 0.1, 'No Tiene Whatsapp': 0.1}
+PREFIJOS_CEDULA = ['001', '402', '031', '223', '047', '056', '026', '037']
+CODIGOS_AREA = ['809', '829', '849']
+
+def generate_campaign(rows, seed):
+    """DataFrame con registros sintéticos; las cédulas no se repiten"""
+    rng = np.random.default_rng(seed)
+    pick = lambda options: pd.Series(rng.choice(options, rows))
+    nombres = pick(NOMBRES) + ' ' + pick(APELLIDOS) + ' ' + pick(APELLIDOS)
+    cuerpo = pd.Series(rng.choice(10 ** 8, rows, replace=False)).astype(str).str.zfill(8)
+    cedulas = pick(PREFIJOS_CEDULA) + '-' + cuerpo.str[:7] + '-' + cuerpo.str[7:]
+
+    def telefonos():
+        numeros = pd.Series(rng.integers(2000000, 9999999, rows)).astype(str)
+        return pick(CODIGOS_AREA) + '-' + numeros.str[:3] + '-' + numeros.str[3:]
+
+    segundos = pd.to_timedelta(rng.integers(0, 90 * 24 * 3600, rows), unit='s')
+    return pd.DataFrame({
+        'Nombre': nombres,
+        'Cedula': cedulas,
+        'Telefono': telefonos(),
+        'Telefono2': telefonos().where(rng.random(rows) < 0.4, ''),
+        'Estatus': rng.choice(list(ESTATUS_PESOS), rows, p=list(ESTATUS_PESOS.values())),
+        'Comentario': pick(COMENTARIOS),
+        'FechaActualizacion': (pd.Timestamp(datetime.now()) - segundos).strftime('%Y-%m-%d %H:%M:%S'),
+    })
+
+def summarize(timings, errors, peak_bytes):
+    """Percentiles (en milisegundos) de las duraciones de un escenario"""
+    ms = pd.Series(timings) * 1000
+    return {
+        'runs': len(timings),
+        'errors': errors,
+        'mean_ms': round(ms.mean(), 3),
+        'min_ms': round(ms.min(), 3),
+        'p50_ms': round(ms.quantile(0.5), 3),
+        'p90_ms': round(ms.quantile(0.9), 3),
+        'p95_ms': round(ms.quantile(0.95), 3),
+        'p99_ms': round(ms.quantile(0.99), 3),
+        'max_ms': round(ms.max(), 3),
+        'peak_alloc_bytes': peak_bytes,
+    }
+
+def failed(client, response):
+    """Respuesta con error: código >= 400 o un mensaje flash de error (las
+    rutas de formularios siempre redirigen). Los mensajes se descartan para
+    que la cookie de sesión no crezca entre peticiones."""
+    with client.session_transaction() as session:
+        flashes = session.pop('_flashes', [])
+    return response.status_code >= 400 or any(category == 'error' for category, _ in flashes)
+
+def measure(client, run, repeat):
+    """Ejecutar run(i) repeat veces midiendo la duración, y una vez más con
+    tracemalloc para obtener el pico de memoria (así el rastreo no altera
+    los tiempos)"""
+    timings = []
+    errors = 0
+    for i in range(repeat):
+        start = time.perf_counter()
+        response = run(i)
+        timings.append(time.perf_counter() - start)
+        errors += failed(client, response)
+    tracemalloc.start()
+    try:
+        response = run(repeat)
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    errors += failed(client, response)
+    return summarize(timings, errors, peak_bytes)
+
+def benchmark_campaign(crm, client, rows, repeat, seed):
+    """Crear una campaña sintética de rows registros y medir cada escenario"""
+    campaign_name = f'Benchmark {rows}'
+    start = time.perf_counter()
+    df = generate_campaign(rows, seed)
+    with crm.campaigns_list_lock():
+        crm.campaign_registry.add(campaign_name)
+    crm.storage.write(crm.normalize_data(df), campaign_name)
+    setup_seconds = time.perf_counter() - start
+
+    url = f'/campaign/{campaign_name}'
+    cedulas = df['Cedula'].sample(repeat + 1, random_state=seed, replace=rows <= repeat).tolist()
+    apellidos = [APELLIDOS[i % len(APELLIDOS)] for i in range(repeat + 1)]
+    new_cedula = lambda i: f'999-{rows:07d}-{i}'
+
+    def cold_load(i):
+        crm.campaign_cache.invalidate(campaign_name)
+        return client.get(url)
+
+    scenarios = {
+        'cold_load': cold_load,
+        'index': lambda i: client.get(url),
+        'search': lambda i: client.get(url, query_string={'query': apellidos[i]}),
+        'filter': lambda i: client.get(url, query_string={'estatus_filter': 'Llamado'}),
+        'search_filter_sort': lambda i: client.get(url, query_string={
+            'query': apellidos[i], 'estatus_filter': 'Pendiente', 'sort': 'Nombre'}),
+        'stats': lambda i: client.get('/api/stats'),
+        'edit_record': lambda i: client.post(f'{url}/edit', data={
+            'Cedula': cedulas[i], 'Estatus': 'Llamado', 'Comentario': f'Benchmark {i}'}),
+        'add_record': lambda i: client.post(f'{url}/add', data={
+            'Nombre': f'Prueba {i}', 'Cedula': new_cedula(i), 'Telefono': '809-555-0000'}),
+        'delete_record': lambda i: client.post(f'{url}/delete/{new_cedula(i)}'),
+    }
+    results = {}
+    for name, run in scenarios.items():
+        print(f'  {rows} registros: {name}', file=sys.stderr)
+        results[name] = measure(client, run, repeat)
+    return {'rows': rows, 'setup_seconds': round(setup_seconds, 3), 'scenarios': results}
+
+def benchmark_campaign_creation(client, repeat):
+    """Medir la creación y eliminación de campañas vacías"""
+    create = lambda i: client.post('/add_campaign', data={'campaign_name': f'Nueva {i}'})
+    delete = lambda i: client.post(f'/delete_campaign/Nueva {i}')
+    return {'create_campaign': measure(client, create, repeat), 'delete_campaign': measure(client, delete, repeat)}
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del CRM con campañas sintéticas')
+    parser.add_argument('--sizes', default='1000,10000,100000',
+                        help='Tamaños de campaña separados por comas (por ejemplo 1000,10000,100000,1000000)')
+    parser.add_argument('--repeat', type=int, default=20, help='Repeticiones de cada escenario')
+    parser.add_argument('--seed', type=int, default=1, help='Semilla de los datos sintéticos')
+    parser.add_argument('--output', help='Archivo JSON de salida (por defecto, la salida estándar)')
+    parser.add_argument('--keep', action='store_true', help='No borrar la carpeta temporal de campañas')
+    args = parser.parse_args()
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    work_dir = tempfile.mkdtemp(prefix='xoocrm-benchmark-')
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        import app as crm
+        client = crm.configure_app({'CAMPAIGNS_DIR': os.path.join(work_dir, 'campañas')}).test_client()
+
+        started = time.perf_counter()
+        report = {
+            'meta': {
+                'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'python': platform.python_version(),
+                'pandas': pd.__version__,
+                'platform': platform.platform(),
+                'storage_backend': crm.STORAGE_BACKEND,
+                'write_behind': crm.WRITE_BEHIND,
+                'arrow_sidecar': crm.ARROW_SIDECAR,
+                'repeat': args.repeat,
+                'seed': args.seed,
+            },
+            'campaigns': [benchmark_campaign(crm, client, rows, args.repeat, args.seed) for rows in sizes],
+            'campaign_creation': benchmark_campaign_creation(client, args.repeat),
+        }
+        report['total_seconds'] = round(time.perf_counter() - started, 3)
+        if resource is not None:
+            # ru_maxrss está en KB en Linux y en bytes en macOS
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            report['max_rss_bytes'] = max_rss if sys.platform == 'darwin' else max_rss * 1024
+    finally:
+        crm = sys.modules.get('app')
+        if crm is not None:
+            # Guardar lo pendiente antes de borrar la carpeta temporal
+            crm.write_behind.stop()
+            crm.search_index.save(force=True)
+        if args.keep:
+            print(f'Campañas de prueba en {work_dir}', file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
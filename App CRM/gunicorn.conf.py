@@ -0,0 +1,20 @@
+"""Configuración de gunicorn: gunicorn -c gunicorn.conf.py wsgi:app"""
+import os
+
+bind = os.environ.get('CRM_BIND', '0.0.0.0:8000')
+# Por defecto un solo proceso con varios hilos: cada proceso carga su propia
+# copia de las campañas en caché. Las reservas del Modo Agente se comparten
+# entre procesos, así que se puede subir CRM_WORKERS si la memoria alcanza,
+# pero no con CRM_WRITE_BEHIND=1: los cambios diferidos solo están en la
+# memoria del worker que los recibió, los demás no los verían al comprobar
+# la versión de un registro y una edición podría pisar otra sin error.
+workers = int(os.environ.get('CRM_WORKERS', '1'))
+if workers > 1 and os.environ.get('CRM_WRITE_BEHIND', '0') == '1':
+    raise SystemExit('Error: CRM_WRITE_BEHIND=1 solo funciona con un worker (CRM_WORKERS=1)')
+threads = int(os.environ.get('CRM_THREADS', '8'))
+worker_class = 'gthread'
+# Importaciones y exportaciones grandes pueden tardar
+timeout = 120
+# Sin preload: cada worker importa la aplicación y arranca su propio hilo
+# de escritura diferida
+preload_app = False
@@ -0,0 +1,18 @@
+"""Punto de entrada WSGI para producción.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    waitress-serve --threads=8 --listen=0.0.0.0:8000 wsgi:app
+
+Todos los workers deben compartir la misma CRM_SECRET_KEY (con ella se
+firman la sesión y los mensajes) y la misma carpeta de campañas
+(CRM_CAMPAIGNS_DIR); los candados de archivo coordinan las escrituras
+entre procesos.
+"""
+import os
+
+from app import configure_app
+
+if 'CRM_SECRET_KEY' not in os.environ:
+    print("Advertencia: CRM_SECRET_KEY no está definida; se usa la clave de desarrollo")
+
+app = configure_app()